@@ -17,174 +17,1080 @@ Github: https://github.com/rmountjoy92
 
 License: MIT
 """
+import os
 import re
-import json
-from markupsafe import Markup
-from secrets import token_hex
-from functools import wraps
-from time import sleep
-from threading import Thread
-from flask_bcrypt import Bcrypt
+import ast
+import marshal
+import operator
+from array import array
+from collections import OrderedDict, deque
+from itertools import islice
+from functools import wraps, partial, lru_cache
+from bisect import bisect_left
+from time import time, perf_counter
+from threading import Thread, Condition, Lock, Event
+
+try:
+    from re import _parser as _regex_parser, _constants as _regex_constants
+except ImportError:  # python < 3.11
+    import sre_parse as _regex_parser, sre_constants as _regex_constants
+from .stores import TokenStore, MemoryTokenStore, SQLiteTokenStore, KeyValueTokenStore
 
 
 class WolfForms:
-    def __init__(self, app=None, csrf_ttl=None):
+    # bumped by custom_validate_function so compiled plans pick up new rules
+    _rule_generation = 0
+    adhoc_plan_cache_size = 128
+    field_cache_size = 256
+    async_timeout = 10
+    csrf_client_cache_size = 10000
+
+    def __init__(
+        self,
+        app=None,
+        csrf_ttl=None,
+        signed_csrf=False,
+        secret_key=None,
+        token_store=None,
+        csrf_capacity=None,
+        csrf_per_client=False,
+        max_field_size=None,
+        max_list_items=None,
+        instrumentation=None,
+        csrf_workers=None,
+        csrf_queue_size=None,
+        validate_cache_size=None,
+        validate_cache_ttl=60,
+    ):
         self.app = None
-        self.bcrypt = Bcrypt()
-        self.csrf_tokens = []
-        self.hashed_tokens = {}
+        # flask_bcrypt, asyncio, hmac and the like are imported when csrf or
+        # async validation is first used, so validation alone imports fast
+        self._bcrypt = None
+        if token_store is None:
+            token_store = MemoryTokenStore(capacity=csrf_capacity)
+        self.token_store = token_store
         self.csrf_ttl = csrf_ttl or 600
+
+        # per client reuse: generate_csrf(client_key=...) hands out the same
+        # token to a client while more than half of its ttl is left. the
+        # flask integration keys clients by a random id in the session.
+        self.csrf_per_client = csrf_per_client
+        self._client_tokens = OrderedDict()
+        self.csrf_reused = 0
         self.forms = {}
 
+        # default limits for parsing list and dict fields, see parse_form
+        self.max_field_size = max_field_size
+        self.max_list_items = max_list_items
+
+        # compiled forms, form_name -> (plan, parse plan, ...), see
+        # compile_form. load_forms replaces the forms and _plans dicts rather
+        # than changing them, so running validations keep their plans.
+        self._plans = {}
+        self._adhoc_plans = OrderedDict()
+        self._field_results = OrderedDict()
+
+        # resubmit cache: with a validate_cache_size, validate keeps the
+        # Response of recent submissions of forms that only use built in
+        # rules for validate_cache_ttl seconds, keyed by the submitted values
+        self.validate_cache_size = validate_cache_size
+        self.validate_cache_ttl = validate_cache_ttl
+        self._validate_results = OrderedDict()
+        self.validate_cache_hits = 0
+        self.validate_cache_misses = 0
+
+        # forms loaded from files, see load_forms and watch_forms
+        self._form_files = None
+        self._file_forms = frozenset()
+        # names given to add_form, kept over forms of the same name in files
+        self._added_forms = set()
+        self._watch_thread = None
+        self._watch_stop = Event()
+        self.reload_error = None
+        self._plans_generation = WolfForms._rule_generation
+
+        # stateless mode: tokens are HMAC-SHA256 signed over a nonce and an
+        # expiry timestamp, nothing is stored server side and bcrypt is unused.
+        # without a secret_key (or app.secret_key) a random per process key is
+        # used, which only works with a single worker.
+        self.signed_csrf = signed_csrf
+        self.secret_key = secret_key
+        self._fallback_secret_key = os.urandom(32)
+
+        # single expiry scheduler: one background thread sleeps until the
+        # store's next expiry and bulk expires it, it only runs while the
+        # store has tokens that need expiring
+        self._expiry_condition = Condition()
+        self._expiry_thread = None
+        self._next_expiry = None
+
+        # bcrypt offload: with csrf_workers, hashing and checking csrf tokens
+        # runs on a pool of that many threads. at most csrf_workers +
+        # csrf_queue_size (default 4 per worker) calls are in flight, past
+        # that validate_token fails and generate_csrf raises straight away
+        # instead of queueing more bcrypt work.
+        self._csrf_executor = None
+        if csrf_workers:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._csrf_executor = ThreadPoolExecutor(
+                csrf_workers, thread_name_prefix="wolf_forms_csrf"
+            )
+        if csrf_queue_size is None:
+            csrf_queue_size = 4 * (csrf_workers or 0)
+        self.csrf_max_in_flight = (csrf_workers or 0) + csrf_queue_size
+        self._csrf_lock = Lock()
+        self.csrf_in_flight = 0
+        self.csrf_rejected = 0
+        self.csrf_hashed = 0
+        self.csrf_queue_wait = 0.0
+        self.csrf_queue_wait_max = 0.0
+
+        # optional per rule and csrf timing, see Instrumentation
+        self.instrumentation = instrumentation
+
         self.init_app(app)
 
+    @property
+    def bcrypt(self):
+        if self._bcrypt is None:
+            from flask_bcrypt import Bcrypt
+
+            self._bcrypt = Bcrypt(self.app)
+        return self._bcrypt
+
     def init_app(self, app):
         if app:
             self.app = app
-            self.bcrypt.init_app(app)
+            if self._bcrypt is not None:
+                self._bcrypt.init_app(app)
 
             @app.context_processor
             def provide_csrf_input_html():
-                html = (
-                    f'<input name="csrf_token" value="{self.generate_csrf()}" '
-                    f'style="display: none">'
+                return dict(wf_csrf_token=LazyCsrfInput(self))
+
+    def request_csrf(self):
+        # one token per request, shared by every form rendered in it
+        from flask import g
+
+        if "wf_csrf_token" not in g:
+            client_key = None
+            if self.csrf_per_client:
+                from flask import session
+
+                client_key = session.setdefault("wf_csrf_client", os.urandom(8).hex())
+            g.wf_csrf_token = self.generate_csrf(client_key=client_key)
+        return g.wf_csrf_token
+
+    def generate_csrf(self, ttl=None, client_key=None):
+        if self.instrumentation is None:
+            return self._generate_client_csrf(ttl, client_key)
+        start = perf_counter()
+        token = self._generate_client_csrf(ttl, client_key)
+        self.instrumentation.record(
+            None, "csrf_token", "generate_csrf", perf_counter() - start, False
+        )
+        return token
+
+    def _generate_client_csrf(self, ttl=None, client_key=None):
+        if client_key is None:
+            return self._generate_csrf(ttl)
+
+        now = time()
+        ttl = ttl or self.csrf_ttl
+        try:
+            token, expires_at = self._client_tokens[client_key]
+            self._client_tokens.move_to_end(client_key)
+        except KeyError:
+            pass
+        else:
+            if expires_at - now > ttl / 2 and (
+                self.signed_csrf
+                or self.token_store.get(int(token.split(":")[0])) is not None
+            ):
+                self.csrf_reused += 1
+                return token
+
+        token = self._generate_csrf(ttl)
+        self._client_tokens[client_key] = (token, now + ttl)
+        while len(self._client_tokens) > self.csrf_client_cache_size:
+            try:
+                self._client_tokens.popitem(last=False)
+            except KeyError:
+                break
+        return token
+
+    def csrf_stats(self):
+        stats = {
+            "reused": self.csrf_reused,
+            "clients": len(self._client_tokens),
+        }
+        if self._csrf_executor is not None:
+            stats.update(
+                {
+                    "in_flight": self.csrf_in_flight,
+                    "rejected": self.csrf_rejected,
+                    "hashed": self.csrf_hashed,
+                    "queue_wait_mean": self.csrf_queue_wait / (self.csrf_hashed or 1),
+                    "queue_wait_max": self.csrf_queue_wait_max,
+                }
+            )
+        if hasattr(self.token_store, "stats"):
+            stats.update(self.token_store.stats())
+        return stats
+
+    def submit_csrf_hash(self, func, *args):
+        # runs a bcrypt call on the csrf executor, returns its Future or None
+        # when csrf_max_in_flight calls are already running or queued
+        with self._csrf_lock:
+            if self.csrf_in_flight >= self.csrf_max_in_flight:
+                self.csrf_rejected += 1
+                return None
+            self.csrf_in_flight += 1
+        submitted = perf_counter()
+
+        def run():
+            waited = perf_counter() - submitted
+            with self._csrf_lock:
+                self.csrf_hashed += 1
+                self.csrf_queue_wait += waited
+                if waited > self.csrf_queue_wait_max:
+                    self.csrf_queue_wait_max = waited
+            if self.instrumentation is not None:
+                self.instrumentation.record(
+                    None, "csrf_token", "queue_wait", waited, False
                 )
-                return dict(wf_csrf_token=Markup(html))
-
-    def generate_csrf(self, ttl=None):
-        token_id = len(self.csrf_tokens) + 1
-        self.csrf_tokens.append(token_id)
-        csrf_token = f"{token_hex(16)}"
-        hashed_csrf_token = self.bcrypt.generate_password_hash(csrf_token)
-        self.hashed_tokens[token_id] = hashed_csrf_token
-        proc = Thread(target=self.expire_csrf, args=[token_id, ttl], daemon=True)
-        proc.start()
+            try:
+                return func(*args)
+            finally:
+                with self._csrf_lock:
+                    self.csrf_in_flight -= 1
+
+        try:
+            return self._csrf_executor.submit(run)
+        except Exception:
+            with self._csrf_lock:
+                self.csrf_in_flight -= 1
+            raise
+
+    def _generate_csrf(self, ttl=None):
+        if self.signed_csrf:
+            return self.generate_signed_csrf(ttl)
+
+        csrf_token = os.urandom(16).hex()
+        if self._csrf_executor is None:
+            hashed_csrf_token = self.bcrypt.generate_password_hash(csrf_token)
+        else:
+            future = self.submit_csrf_hash(
+                self.bcrypt.generate_password_hash, csrf_token
+            )
+            if future is None:
+                raise Exception("Too many csrf tokens are being hashed, try again")
+            hashed_csrf_token = future.result()
+        expires_at = time() + (ttl or self.csrf_ttl)
+        token_id = self.token_store.add(hashed_csrf_token, expires_at)
+        if getattr(self.token_store, "expires_locally", True):
+            self.schedule_expiry(expires_at)
         return f"{token_id}:{csrf_token}"
 
-    def expire_csrf(self, token_id, ttl):
-        sleep(ttl or self.csrf_ttl)
-        self.csrf_tokens.remove(token_id)
-        del self.hashed_tokens[token_id]
+    def schedule_expiry(self, expires_at):
+        with self._expiry_condition:
+            if self._expiry_thread is None:
+                self._expiry_thread = Thread(target=self._run_expiry, daemon=True)
+                self._expiry_thread.start()
+            elif self._next_expiry is None or expires_at < self._next_expiry:
+                # new earliest deadline, wake the scheduler so it re-sleeps
+                self._expiry_condition.notify()
+
+    def _run_expiry(self):
+        with self._expiry_condition:
+            while True:
+                self._next_expiry = self.token_store.next_expiry()
+                if self._next_expiry is None:
+                    break
+                remaining = self._next_expiry - time()
+                if remaining > 0:
+                    self._expiry_condition.wait(remaining)
+                    continue
+                self.token_store.expire(time())
+            self._expiry_thread = None
+
+    def expire_csrf(self, token_id):
+        self.token_store.delete(token_id)
+
+    def _sign(self, message):
+        import hmac
+
+        # app.secret_key is read on every call, it may be set after init_app
+        key = (
+            self.secret_key
+            or (self.app.secret_key if self.app else None)
+            or self._fallback_secret_key
+        )
+        if isinstance(key, str):
+            key = key.encode()
+        return hmac.new(key, message.encode(), "sha256").hexdigest()
+
+    def generate_signed_csrf(self, ttl=None):
+        # expiry is stored in milliseconds so short ttls are honoured
+        expires_at = int((time() + (ttl or self.csrf_ttl)) * 1000)
+        message = f"{expires_at}:{os.urandom(16).hex()}"
+        return f"{message}:{self._sign(message)}"
+
+    def validate_signed_token(self, token):
+        import hmac
 
-    def validate_token(self, token):
         try:
-            token_id = int(token.split(":")[0])
+            expires_at, nonce, signature = token.split(":")
+            expires_at = int(expires_at)
         except ValueError:
             return False
-        try:
-            token = token.split(":")[1]
-        except IndexError:
+
+        # compared as bytes, compare_digest raises on non ascii strings
+        if not hmac.compare_digest(
+            self._sign(f"{expires_at}:{nonce}").encode(), signature.encode()
+        ):
             return False
+        return expires_at > time() * 1000
 
+    def validate_token(self, token):
+        if self.instrumentation is None:
+            return self._validate_token(token)
+        start = perf_counter()
+        valid = self._validate_token(token)
+        self.instrumentation.record(
+            None, "csrf_token", "validate_token", perf_counter() - start, not valid
+        )
+        return valid
+
+    def _validate_token(self, token):
+        if self.signed_csrf:
+            return self.validate_signed_token(token)
+
+        record = self.lookup_token(token)
+        if record is None:
+            return False
+        if self._csrf_executor is None:
+            return self.bcrypt.check_password_hash(*record)
+        future = self.submit_csrf_hash(self.bcrypt.check_password_hash, *record)
+        return future is not None and future.result()
+
+    def lookup_token(self, token):
+        # (hashed token, token) for bcrypt to check, None when the token isn't
+        # in the store or has expired
         try:
-            check_hash = self.bcrypt.check_password_hash(
-                self.hashed_tokens[token_id], token
+            token_id, token = token.split(":")
+            token_id = int(token_id)
+        except ValueError:
+            return None
+
+        record = self.token_store.get(token_id)
+        if record is None:
+            return None
+
+        # expiry is also checked lazily so a token is rejected the moment its
+        # ttl passes, even if the scheduler has not drained it yet
+        hashed_csrf_token, expires_at = record
+        if expires_at <= time():
+            return None
+        return hashed_csrf_token, token
+
+    def validate_token_future(self, token):
+        # validate_token as a concurrent.futures.Future. with csrf_workers the
+        # bcrypt check runs on the csrf executor without blocking the caller
+        from concurrent.futures import Future
+
+        start = perf_counter()
+        future = None
+        if self._csrf_executor is not None and not self.signed_csrf:
+            record = self.lookup_token(token)
+            if record is not None:
+                future = self.submit_csrf_hash(self.bcrypt.check_password_hash, *record)
+            if future is None:
+                future = Future()
+                future.set_result(False)
+        else:
+            future = Future()
+            future.set_result(self._validate_token(token))
+
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            future.add_done_callback(
+                lambda done: instrumentation.record(
+                    None,
+                    "csrf_token",
+                    "validate_token",
+                    perf_counter() - start,
+                    done.exception() is not None or not done.result(),
+                )
             )
-        except KeyError:
-            return False
-        return check_hash
+        return future
+
+    async def avalidate_token(self, token):
+        from asyncio import wrap_future
+
+        return await wrap_future(self.validate_token_future(token))
 
     def add_form(self, form_name, validators):
-        if not isinstance(form_name, str):
-            raise Exception("form_name must be a string")
+        check_form(form_name, validators)
+        compiled = self.compile_form(validators)
+        self.forms[form_name] = validators
+        self._plans[form_name] = compiled
+        self._added_forms.add(form_name)
+        self._field_results.clear()
+        self._validate_results.clear()
+
+    def compile_form(self, validators):
+        # (plan, parse plan, field index, pure, fail_fast plan), pure when
+        # only built in rules are used so results only depend on the
+        # submitted values
+        plan = self.compile_validators(validators)
+        index = index_plan(plan)
+        pure = all(field_pure for _, field_pure in index.values())
+        return plan, compile_parse_plan(validators), index, pure, fail_fast_plan(plan)
+
+    def load_forms(self, paths, cache_dir=None):
+        # bulk add_form from json files that map form names to validators.
+        # paths is a file, a directory of .json files or a list of them.
+        # with a cache_dir the parsed and checked definitions are saved there
+        # keyed by a hash of the files, so later starts with the same files
+        # skip that work. expressions are always compiled and checked again.
+        # forms from files replace the ones previously loaded from files in
+        # one swap. forms added with add_form are kept, also over a form of
+        # the same name in the files. returns the names loaded from files.
+        files = form_files(paths)
+        signature = files_signature(files)
+        artifact = load_form_artifact(files, cache_dir)
+
+        self._check_plans_generation()
+        file_forms = {
+            form_name: validators
+            for form_name, validators in artifact["forms"].items()
+            if form_name not in self._added_forms
+        }
+        forms = {
+            form_name: validators
+            for form_name, validators in self.forms.items()
+            if form_name not in self._file_forms or form_name in self._added_forms
+        }
+        forms.update(file_forms)
+        plans = {}
+        for form_name, validators in forms.items():
+            if form_name in file_forms or form_name not in self._plans:
+                plans[form_name] = self.compile_form(validators)
+            else:
+                plans[form_name] = self._plans[form_name]
+
+        self.forms = forms
+        self._plans = plans
+        self._file_forms = frozenset(file_forms)
+        self._form_files = (paths, cache_dir, signature)
+        self._field_results.clear()
+        self._validate_results.clear()
+        return sorted(file_forms)
 
-        if not isinstance(validators, list):
-            raise Exception("Validators must be a list")
+    def reload_forms(self):
+        # loads the files given to load_forms again if any of them changed,
+        # returns True when the forms were reloaded
+        if self._form_files is None:
+            return False
+        paths, cache_dir, signature = self._form_files
+        if files_signature(form_files(paths)) == signature:
+            return False
+        self.load_forms(paths, cache_dir)
+        return True
 
-        if len(validators) < 1:
-            raise Exception("You must have at least one validator for the form")
+    def watch_forms(self, interval=1.0):
+        # hot reload, a background thread calls reload_forms every interval
+        # seconds. a failed reload keeps the current forms and the exception
+        # is kept in reload_error
+        if self._watch_thread is not None:
+            return
+        self._watch_stop.clear()
+        self._watch_thread = Thread(
+            target=self._watch_forms, args=(interval,), daemon=True
+        )
+        self._watch_thread.start()
 
+    def _watch_forms(self, interval):
+        while not self._watch_stop.wait(interval):
+            try:
+                if self.reload_forms():
+                    self.reload_error = None
+            except Exception as e:
+                self.reload_error = e
+
+    def stop_watching_forms(self):
+        if self._watch_thread is None:
+            return
+        self._watch_stop.set()
+        self._watch_thread.join()
+        self._watch_thread = None
+
+    def compile_validators(self, validators):
+        # resolve every rule once into a tuple of
+        # (field_name, ((validate_class_method, validate_function, value), ...))
+        plan = []
         for validator in validators:
-            if not isinstance(validator, dict):
-                raise Exception("Each validator must be a dict")
             field_name = f"{next(iter(validator))}"
-            if not isinstance(field_name, str):
-                raise Exception("field_name must be a string")
-            if not isinstance(validator[field_name], dict):
-                raise Exception("Validator field methods must be a dict")
+            rules = []
+            for validate_function, value in validator.get(field_name, {}).items():
+                if validate_function == "type":
+                    validate_function = "_type"
+                if validate_function in compiled_rules:
+                    # bind the compiled regex / expression so requests skip
+                    # recompiling it
+                    compile_value, method_name = compiled_rules[validate_function]
+                    validate_class_method = partial(
+                        getattr(self, method_name), compile_value(value)
+                    )
+                else:
+                    validate_class_method = getattr(
+                        self, validate_function, self.class_method_not_found
+                    )
+                    if validate_function not in rule_costs and is_coroutine_function(
+                        validate_class_method
+                    ):
+                        validate_class_method = AsyncRule(validate_class_method)
+                rules.append((validate_class_method, validate_function, value))
+            plan.append((field_name, order_rules(rules)))
+        return tuple(plan)
 
-        self.forms[form_name] = validators
+    def _check_plans_generation(self):
+        if self._plans_generation != WolfForms._rule_generation:
+            self._plans_generation = WolfForms._rule_generation
+            self._adhoc_plans.clear()
+            self._field_results.clear()
+            self._validate_results.clear()
+            self._plans = {
+                form_name: self.compile_form(validators)
+                for form_name, validators in self.forms.items()
+            }
+
+    def get_compiled(self, form_name):
+        self._check_plans_generation()
+        try:
+            return self._plans[form_name]
+        except KeyError:
+            compiled = self.compile_form(self.forms[form_name])
+            self._plans[form_name] = compiled
+            return compiled
+
+    def get_plan(self, form_name, fail_fast=False):
+        return self.get_compiled(form_name)[4 if fail_fast else 0]
 
-    def parse_form(self, form, form_name):
+    def get_field_rules(self, form_name, field_name):
+        # (rule groups, pure) for one field of a form, pure when every rule is
+        # a built in so its result only depends on the value
+        return self.get_compiled(form_name)[2][field_name]
+
+    def validate_field(self, form_name, field_name, value):
+        # validate a single field, e.g. for live checks while a form is filled
+        # in. results of built in rules are memoized for recent values.
+        self._check_plans_generation()
+        response = Response()
+        try:
+            groups, pure = self.get_field_rules(form_name, field_name)
+        except KeyError:
+            response.valid = False
+            response.errors.append(
+                Error(error=f"Field: {field_name} not found in form {form_name}")
+            )
+            return response
+
+        # keyed with the value's type so 1, 1.0 and True don't share a result
+        key = (form_name, field_name, type(value), value) if pure else None
+        if key is not None:
+            try:
+                cached = self._field_results[key]
+            except KeyError:
+                pass
+            except TypeError:
+                # unhashable values are not memoized
+                key = None
+            else:
+                try:
+                    self._field_results.move_to_end(key)
+                except KeyError:
+                    pass
+                # a copy, callers may add their own errors to the response
+                return Response(cached.valid, list(cached.errors))
+
+        form = {field_name: value}
+        for rules in groups:
+            response = self.run_rules(form, response, field_name, rules)
+
+        if key is not None:
+            self._field_results[key] = Response(response.valid, list(response.errors))
+            if len(self._field_results) > self.field_cache_size:
+                try:
+                    self._field_results.popitem(last=False)
+                except KeyError:
+                    pass
+        return response
+
+    def get_parse_plan(self, form_name):
+        return self.get_compiled(form_name)[1]
+
+    def get_adhoc_plan(self, validators, fail_fast=False):
+        self._check_plans_generation()
+        try:
+            key = plan_key(validators)
+        except TypeError:
+            # a value that can't be hashed, the plan isn't cached
+            plan = self.compile_validators(validators)
+            return fail_fast_plan(plan) if fail_fast else plan
+        try:
+            self._adhoc_plans.move_to_end(key)
+            plans = self._adhoc_plans[key]
+        except KeyError:
+            plan = self.compile_validators(validators)
+            plans = (plan, fail_fast_plan(plan))
+            self._adhoc_plans[key] = plans
+            if len(self._adhoc_plans) > self.adhoc_plan_cache_size:
+                self._adhoc_plans.popitem(last=False)
+        return plans[1 if fail_fast else 0]
+
+    def parse_form(self, form, form_name, lazy=False):
+        # list and dict fields are checked against the field's max_length and
+        # max_items (or max_field_size / max_list_items) before they are
+        # parsed. lists with an item_type of int or float become compact
+        # arrays and bool items become bools, with lazy=True lists are
+        # returned as iterators instead.
         parsed_form = {}
         for key, value in form.items():
             parsed_form[key] = value
 
-        validators = self.forms[form_name]
-        for validator in validators:
-            field_name = f"{next(iter(validator))}"
-            if parsed_form[field_name] or validator[field_name].get("required"):
+        for field_name, type_name, required, limits in self.get_parse_plan(form_name):
+            if type_name and (parsed_form[field_name] or required):
+                error = self.check_parse_limits(
+                    parsed_form[field_name], type_name, limits
+                )
+                if error:
+                    raise Exception(f"Could not parse {field_name}, error was: {error}")
                 try:
-                    if validator[field_name].get("type"):
-                        if validator[field_name]["type"] == "dict":
-                            parsed_form[field_name] = json.loads(
-                                parsed_form[field_name]
-                            )
-                        if validator[field_name]["type"] == "list":
-                            parsed_form[field_name] = parsed_form[field_name].split(",")
-
-                        if validator[field_name]["type"] == "bool":
-                            if parsed_form[field_name].lower() == "true":
-                                parsed_form[field_name] = True
-                            elif parsed_form[field_name].lower() == "false":
-                                parsed_form[field_name] = False
-                            else:
-                                raise ValueError(
-                                    f"Could not convert {parsed_form[field_name]} to bool"
-                                )
-                        else:
-                            parsed_form[field_name] = py_types[
-                                validator[field_name]["type"]
-                            ](parsed_form[field_name])
+                    parsed_form[field_name] = parse_value(
+                        parsed_form[field_name], type_name, limits[2], lazy
+                    )
                 except Exception as e:
                     raise Exception(f"Could not parse {field_name}, error was: {e}")
         return parsed_form
 
-    def validate(self, form, form_name, validators=None, csrf=False):
+    def check_parse_limits(self, value, type_name, limits):
+        # cheap checks on the raw string, done before anything is allocated
+        if type_name not in ("list", "dict") or not isinstance(value, str):
+            return None
+        max_size, max_items, item_type = limits
+        max_size = max_size or self.max_field_size
+        if max_size is not None and len(value) > max_size:
+            return f"{len(value)} characters is more than the maximum of {max_size}"
+        max_items = max_items or self.max_list_items
+        if type_name == "list" and max_items is not None:
+            items = value.count(",") + 1
+            if items > max_items:
+                return f"{items} items is more than the maximum of {max_items}"
+        return None
+
+    def validate_and_parse(
+        self, form, form_name, csrf=False, fail_fast=False, lazy=False
+    ):
+        # validate and parse_form in one walk over the form's fields. form can
+        # be any mapping (e.g. a werkzeug MultiDict), it is read through a
+        # FormView and never copied or mutated. returns the Response and a
+        # dict of the form's fields converted to their types.
+        # the python types (str, int, float, list, dict, bool) are checked by
+        # converting the submitted value, so "30" passes type int and parses
+        # to 30. like parse_form, empty fields that aren't required are left
+        # as "". the other rules see the submitted value.
         response = Response()
-        if not validators:
-            validators = []
+        parsed = {}
+        try:
+            plan, parse_plan, _, _, fail_fast_plan = self.get_compiled(form_name)
+        except KeyError:
+            response.valid = False
+            response.errors.append(
+                Error(error=f"Form: {form_name} not found in configured forms")
+            )
+            return response, parsed
 
-        if form_name:
-            try:
-                validators = validators + self.forms[form_name]
-            except KeyError:
+        if fail_fast:
+            plan = fail_fast_plan
+        form = FormView(form)
+        for (field_name, rules), (_, type_name, required, limits) in zip(
+            plan, parse_plan
+        ):
+            errors = len(response.errors)
+            for validate_class_method, validate_function, value in rules:
+                if validate_function == "_type" and value in py_types:
+                    continue
+                if (
+                    validate_function in length_guarded_rules
+                    and len(response.errors) > errors
+                    and length_failed(response.errors, errors)
+                ):
+                    continue
+                response = validate_class_method(
+                    form, response, field_name, validate_function, value
+                )
+                if fail_fast and len(response.errors) != errors:
+                    break
+
+            field_value = form.get(field_name)
+            if len(response.errors) == errors and type_name in py_types:
+                if not isinstance(field_value, py_types[type_name]) and (
+                    field_value or required
+                ):
+                    error = self.check_parse_limits(field_value, type_name, limits)
+                    if error:
+                        error = f"Could not parse {field_name}, error was: {error}"
+                    else:
+                        try:
+                            field_value = parse_value(
+                                field_value, type_name, limits[2], lazy
+                            )
+                        except Exception:
+                            error = f"{field_name} is not {type_name}"
+                    if error:
+                        response.valid = False
+                        response.errors.append(
+                            Error(
+                                error=error,
+                                field_name=field_name,
+                                validate_function="_type",
+                                value=type_name,
+                            )
+                        )
+            parsed[field_name] = field_value
+
+            if fail_fast and fail_fast != "field" and response.valid is False:
+                return response, parsed
+
+        if csrf:
+            if fail_fast and response.valid is False:
+                return response, parsed
+            if not self.validate_token(form.get("csrf_token", "!")):
                 response.valid = False
-                response.errors.append(
-                    Error(error=f"Form: {form_name} not found in configured forms")
+                response.errors.append(Error(error="Failed to validate csrf token"))
+        return response, parsed
+
+    def resolve_plan(self, form_name, validators=None, fail_fast=False):
+        plan = self.get_adhoc_plan(validators, fail_fast) if validators else ()
+        if form_name:
+            plan = plan + self.get_plan(form_name, fail_fast)
+        return plan
+
+    def validate(self, form, form_name, validators=None, csrf=False, fail_fast=False):
+        # fail_fast="field" stops checking a field at its first error,
+        # fail_fast="form" (or True) stops at the first error in the form
+        response = Response()
+        try:
+            plan = self.resolve_plan(form_name, validators, fail_fast)
+        except KeyError:
+            response.valid = False
+            response.errors.append(
+                Error(error=f"Form: {form_name} not found in configured forms")
+            )
+            return response
+
+        key = None
+        cached = None
+        if self.validate_cache_size and form_name and not validators:
+            if self.get_compiled(form_name)[3]:
+                key = validate_cache_key(form, form_name, plan, fail_fast)
+            if key is not None:
+                cached = self.get_cached_response(key, plan)
+
+        if cached is not None:
+            response = cached
+            for field_name, rules in plan:
+                if field_name not in form:
+                    form[field_name] = ""
+        else:
+            run_plan = plan
+            if self.instrumentation is not None:
+                run_plan = self.instrumentation.wrap_plan(form_name, plan)
+            response = self.run_plan(form, run_plan, response, fail_fast)
+            if key is not None:
+                self.cache_response(
+                    key, plan, Response(response.valid, list(response.errors))
                 )
+
+        if csrf:
+            if fail_fast and response.valid is False:
+                return response
+            if not self.validate_token(form.get("csrf_token", "!")):
+                response.valid = False
+                response.errors.append(Error(error="Failed to validate csrf token"))
                 return response
+        return response
 
-        for validator in validators:
-            field_name = f"{next(iter(validator))}"
+    def get_cached_response(self, key, plan):
+        try:
+            cached_plan, response, expires_at = self._validate_results[key]
+        except KeyError:
+            self.validate_cache_misses += 1
+            return None
+        if cached_plan is not plan or expires_at <= time():
+            # the form was redefined or the result is too old
+            self._validate_results.pop(key, None)
+            self.validate_cache_misses += 1
+            return None
+        try:
+            self._validate_results.move_to_end(key)
+        except KeyError:
+            pass
+        self.validate_cache_hits += 1
+        # a copy, callers may add their own errors to the response
+        return Response(response.valid, list(response.errors))
+
+    def cache_response(self, key, plan, response):
+        self._validate_results[key] = (
+            plan,
+            response,
+            time() + self.validate_cache_ttl,
+        )
+        while len(self._validate_results) > self.validate_cache_size:
             try:
-                form[field_name]
+                self._validate_results.popitem(last=False)
             except KeyError:
+                break
+
+    def validate_cache_stats(self):
+        return {
+            "size": len(self._validate_results),
+            "capacity": self.validate_cache_size,
+            "hits": self.validate_cache_hits,
+            "misses": self.validate_cache_misses,
+        }
+
+    async def avalidate(
+        self,
+        form,
+        form_name,
+        validators=None,
+        csrf=False,
+        timeout=None,
+        fail_fast=False,
+    ):
+        # like validate, but async custom validate functions run concurrently.
+        # sync rules still run inline, the async rules' errors are appended
+        # after them in plan order. an async rule still running after timeout
+        # seconds (default async_timeout) is cancelled and fails the field.
+        from asyncio import ensure_future, wait
+
+        response = Response()
+        try:
+            plan = self.resolve_plan(form_name, validators, fail_fast)
+        except KeyError:
+            response.valid = False
+            response.errors.append(
+                Error(error=f"Form: {form_name} not found in configured forms")
+            )
+            return response
+
+        pending = []
+        for field_name, rules in plan:
+            if field_name not in form:
                 form[field_name] = ""
 
-            for validate_function, value in validator.get(field_name, {}).items():
-                if validate_function == "type":
-                    validate_function = "_type"
-                validate_class_method = getattr(
-                    self, validate_function, self.class_method_not_found
-                )
-                response = validate_class_method(
-                    form, response, field_name, validate_function, value
-                )
+            field_errors = len(response.errors)
+            for validate_class_method, validate_function, value in rules:
+                if fail_fast and (
+                    len(response.errors) > field_errors
+                    or fail_fast != "field"
+                    and response.valid is False
+                ):
+                    break
+                if (
+                    validate_function in length_guarded_rules
+                    and len(response.errors) > field_errors
+                    and length_failed(response.errors, field_errors)
+                ):
+                    continue
+                if isinstance(validate_class_method, AsyncRule):
+                    coroutine = validate_class_method.func(
+                        form, Response(), field_name, validate_function, value
+                    )
+                    pending.append(
+                        (field_name, validate_function, value, ensure_future(coroutine))
+                    )
+                else:
+                    response = validate_class_method(
+                        form, response, field_name, validate_function, value
+                    )
+
+        if pending:
+            tasks = [task for _, _, _, task in pending]
+            done, not_done = await wait(tasks, timeout=timeout or self.async_timeout)
+            for field_name, validate_function, value, task in pending:
+                if task in not_done:
+                    task.cancel()
+                    response.valid = False
+                    response.errors.append(
+                        Error(
+                            message="{field_name} timed out in {validate_function}",
+                            field_name=field_name,
+                            validate_function=validate_function,
+                            value=value,
+                        )
+                    )
+                    continue
+                result = task.result()
+                if result.valid is False:
+                    response.valid = False
+                response.errors.extend(result.errors)
 
         if csrf:
-            if not self.validate_token(form.get("csrf_token", "!")):
+            if fail_fast and response.valid is False:
+                return response
+            if not await self.avalidate_token(form.get("csrf_token", "!")):
                 response.valid = False
                 response.errors.append(Error(error="Failed to validate csrf token"))
                 return response
         return response
 
+    @staticmethod
+    def run_rules(form, response, field_name, rules):
+        # once a length rule fails, the field's regex_search and expression
+        # rules are skipped so an oversized value never reaches them
+        start = len(response.errors)
+        for validate_class_method, validate_function, value in rules:
+            if (
+                validate_function in length_guarded_rules
+                and len(response.errors) > start
+                and length_failed(response.errors, start)
+            ):
+                continue
+            response = validate_class_method(
+                form, response, field_name, validate_function, value
+            )
+        return response
+
+    @staticmethod
+    def run_plan(form, plan, response, fail_fast=False):
+        if not fail_fast:
+            for field_name, rules in plan:
+                if field_name not in form:
+                    form[field_name] = ""
+
+                # run_rules inlined, this is the hot loop
+                start = len(response.errors)
+                for validate_class_method, validate_function, value in rules:
+                    if (
+                        validate_function in length_guarded_rules
+                        and len(response.errors) > start
+                        and length_failed(response.errors, start)
+                    ):
+                        continue
+                    response = validate_class_method(
+                        form, response, field_name, validate_function, value
+                    )
+            return response
+
+        # set every missing field first, custom rules may read other fields
+        for field_name, rules in plan:
+            if field_name not in form:
+                form[field_name] = ""
+
+        for field_name, rules in plan:
+            for validate_class_method, validate_function, value in rules:
+                errors = len(response.errors)
+                response = validate_class_method(
+                    form, response, field_name, validate_function, value
+                )
+                if len(response.errors) != errors or (
+                    fail_fast != "field" and response.valid is False
+                ):
+                    break
+            if response.valid is False and fail_fast != "field":
+                return response
+        return response
+
+    def validate_many(self, rows, form_name, workers=None, chunk_size=256):
+        return list(self.iter_validate(rows, form_name, workers, chunk_size))
+
+    def iter_validate(self, rows, form_name, workers=None, chunk_size=256):
+        # yields one Response per row, in row order. with workers > 1 rows are
+        # sent in chunks to a process pool, at most 2 chunks per worker are in
+        # flight so rows can be a lazy iterator of any length. custom validate
+        # functions must be registered at import time to exist in the workers.
+        try:
+            plan = self.get_plan(form_name)
+        except KeyError:
+            raise Exception(f"Form: {form_name} not found in configured forms")
+
+        if not workers or workers < 2:
+            for row in rows:
+                yield self.run_plan(row, plan, Response())
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        rows = iter(rows)
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_init_batch_worker,
+            initargs=(form_name, self.forms[form_name]),
+        ) as pool:
+            pending = deque()
+            while True:
+                while len(pending) < workers * 2:
+                    chunk = list(islice(rows, chunk_size))
+                    if not chunk:
+                        break
+                    pending.append(pool.submit(_validate_chunk, chunk))
+                if not pending:
+                    return
+                yield from pending.popleft().result()
+
+    def validate_columns(self, columns, form_name):
+        # columnar validation of tabular input: columns maps field names to
+        # lists or numpy arrays of equal length. each rule is evaluated over a
+        # whole column at once, errors are only built when a row is read from
+        # the returned ColumnarResult.
+        try:
+            plan = self.get_plan(form_name)
+        except KeyError:
+            raise Exception(f"Form: {form_name} not found in configured forms")
+
+        lengths = {len(column) for column in columns.values()}
+        if len(lengths) > 1:
+            raise Exception("All columns must have the same length")
+        length = lengths.pop() if lengths else 0
+
+        result = ColumnarResult(plan, columns, length)
+        for field_name, rules in plan:
+            column = columns.get(field_name)
+            if column is None:
+                column = [""] * length
+            # rows where a length rule failed, they skip the guarded rules
+            skipped = [False] * length
+            for rule in rules:
+                if rule[1] in length_guarded_rules and any(skipped):
+                    rows = [i for i, failed in enumerate(skipped) if not failed]
+                    failures = column_failures(
+                        [column[i] for i in rows], rule, field_name, result.row
+                    )
+                    if failures is not None:
+                        row_failures = [False] * length
+                        for i, failed in zip(rows, failures):
+                            row_failures[i] = bool(failed)
+                        failures = row_failures
+                else:
+                    failures = column_failures(column, rule, field_name, result.row)
+                if failures is None:
+                    continue
+                result.add_failures(field_name, rule, failures)
+                if rule[1] in length_rules:
+                    skipped = [bool(a or b) for a, b in zip(skipped, failures)]
+        return result
+
     @staticmethod
     def class_method_not_found(form, response, field_name, validate_function, value):
         response.valid = False
         response.errors.append(
             Error(
-                error=f"{validate_function} is not a valid validate function",
+                message="{validate_function} is not a valid validate function",
                 field_name=field_name,
                 validate_function=validate_function,
                 value=value,
@@ -198,7 +1104,7 @@ class WolfForms:
             response.valid = False
             response.errors.append(
                 Error(
-                    error=f"{field_name} is required",
+                    message="{field_name} is required",
                     field_name=field_name,
                     validate_function=validate_function,
                     value=value,
@@ -209,30 +1115,39 @@ class WolfForms:
     @staticmethod
     def _type(form, response, field_name, validate_function, value):
         field_value = form.get(field_name, None)
-        error = Error(
-            field_name=field_name, validate_function=validate_function, value=value
-        )
+        message = None
+        if value in py_types:
+            if not isinstance(field_value, py_types[value]):
+                message = "{field_name} is not {value}"
+        elif value == "email":
+            if not email_regex.match(field_value):
+                message = "{field_name} is not a valid email address"
 
-        for py_type_str, py_type_obj in py_types.items():
-            if value == py_type_str and not isinstance(field_value, py_type_obj):
-                response.valid = False
-                error.error = f"{field_name} is not {py_type_str}"
-                response.errors.append(error)
-        if value == "email":
-            regex = "^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$"
-            if not re.search(regex, field_value):
-                response.valid = False
-                error.error = f"{field_name} is not a valid email address"
-                response.errors.append(error)
+        if message:
+            response.valid = False
+            response.errors.append(
+                Error(
+                    field_name=field_name,
+                    validate_function=validate_function,
+                    value=value,
+                    message=message,
+                )
+            )
         return response
 
     @staticmethod
     def regex_search(form, response, field_name, validate_function, value):
-        if not re.search(value, form.get(field_name)):
+        return WolfForms._regex_search(
+            compile_regex(value), form, response, field_name, validate_function, value
+        )
+
+    @staticmethod
+    def _regex_search(matcher, form, response, field_name, validate_function, value):
+        if not matcher(form.get(field_name)):
             response.valid = False
             response.errors.append(
                 Error(
-                    error=f"{field_name} failed regex search",
+                    message="{field_name} failed regex search",
                     field_name=field_name,
                     validate_function=validate_function,
                     value=value,
@@ -246,7 +1161,7 @@ class WolfForms:
             response.valid = False
             response.errors.append(
                 Error(
-                    error=f"{field_name} must be at least [{value}] characters",
+                    message="{field_name} must be at least [{value}] characters",
                     field_name=field_name,
                     validate_function=validate_function,
                     value=value,
@@ -260,7 +1175,7 @@ class WolfForms:
             response.valid = False
             response.errors.append(
                 Error(
-                    error=f"{field_name} can't be more than [{value}] characters",
+                    message="{field_name} can't be more than [{value}] characters",
                     field_name=field_name,
                     validate_function=validate_function,
                     value=value,
@@ -269,14 +1184,77 @@ class WolfForms:
         return response
 
     @staticmethod
-    def expression(form, response, field_name, validate_function, value):
+    def max_items(form, response, field_name, validate_function, value):
+        field_value = form.get(field_name)
+        if isinstance(field_value, str):
+            items = field_value.count(",") + 1 if field_value else 0
+        else:
+            items = len(field_value)
+        if items > value:
+            response.valid = False
+            response.errors.append(
+                Error(
+                    message="{field_name} can't have more than [{value}] items",
+                    field_name=field_name,
+                    validate_function=validate_function,
+                    value=value,
+                )
+            )
+        return response
+
+    @staticmethod
+    def item_type(form, response, field_name, validate_function, value):
+        return WolfForms._item_type(
+            compile_item_type(value),
+            form,
+            response,
+            field_name,
+            validate_function,
+            value,
+        )
+
+    @staticmethod
+    def _item_type(item_type, form, response, field_name, validate_function, value):
         field_value = form.get(field_name)
-        exp = eval(value)
+        py_type, convert = item_type
+        try:
+            if isinstance(field_value, str):
+                if field_value:
+                    for item in iter_list_items(field_value, convert):
+                        pass
+            elif not all(isinstance(item, py_type) for item in field_value):
+                raise ValueError
+        except ValueError:
+            response.valid = False
+            response.errors.append(
+                Error(
+                    message="{field_name} items must all be {value}",
+                    field_name=field_name,
+                    validate_function=validate_function,
+                    value=value,
+                )
+            )
+        return response
+
+    @staticmethod
+    def expression(form, response, field_name, validate_function, value):
+        return WolfForms._expression(
+            compile_expression(value),
+            form,
+            response,
+            field_name,
+            validate_function,
+            value,
+        )
+
+    @staticmethod
+    def _expression(code, form, response, field_name, validate_function, value):
+        exp = eval(code, expression_globals, {"field_value": form.get(field_name)})
         if exp is False:
             response.valid = False
             response.errors.append(
                 Error(
-                    error=f"{field_name} failed the expression [{value}]",
+                    message="{field_name} failed the expression [{value}]",
                     field_name=field_name,
                     validate_function=validate_function,
                     value=value,
@@ -285,19 +1263,264 @@ class WolfForms:
         return response
 
 
+# state of iter_validate process pool workers
+_batch_wolf_forms = None
+_batch_form_name = None
+
+
+def _init_batch_worker(form_name, validators):
+    global _batch_wolf_forms, _batch_form_name
+    _batch_wolf_forms = WolfForms()
+    _batch_wolf_forms.add_form(form_name, validators)
+    _batch_form_name = form_name
+
+
+def _validate_chunk(rows):
+    plan = _batch_wolf_forms.get_plan(_batch_form_name)
+    return [_batch_wolf_forms.run_plan(row, plan, Response()) for row in rows]
+
+
+def is_coroutine_function(func):
+    # inspect.iscoroutinefunction for functions and bound methods, without
+    # importing inspect
+    code = getattr(func, "__code__", None)
+    return code is not None and bool(code.co_flags & 0x80)  # CO_COROUTINE
+
+
 # custom validate function decorator
-def custom_validate_function(cls):
+def custom_validate_function(cls, cost=None):
+    # cost orders the rule among a field's rules, see rule_costs
     def decorator(func):
-        @wraps(func)
-        def wrapper(self, *args, **kwargs):
-            return func(*args, **kwargs)
+        if is_coroutine_function(func):
+
+            @wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                return await func(*args, **kwargs)
 
+        else:
+
+            @wraps(func)
+            def wrapper(self, *args, **kwargs):
+                return func(*args, **kwargs)
+
+        if cost is not None:
+            wrapper.cost = cost
         setattr(cls, func.__name__, wrapper)
+        WolfForms._rule_generation += 1
 
     return decorator
 
 
+class FormView:
+    # read only view of a submitted form for validate_and_parse. missing
+    # fields read as "" (whatever the default), as if validate had filled
+    # them in, without copying or mutating the form
+    __slots__ = ("form",)
+
+    def __init__(self, form):
+        self.form = form
+
+    def get(self, key, default=None):
+        value = self.form.get(key)
+        if value is None and key not in self.form:
+            return ""
+        return value
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __contains__(self, key):
+        return True
+
+    def __iter__(self):
+        return iter(self.form)
+
+    def __len__(self):
+        return len(self.form)
+
+    def items(self):
+        return self.form.items()
+
+
+class AsyncRule:
+    # an async custom validate function in a compiled plan, only avalidate
+    # can run it
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, form, response, field_name, validate_function, value):
+        raise Exception(
+            f"{validate_function} is an async validate function, use avalidate"
+        )
+
+
+class TimedRule:
+    # a compiled rule wrapped by Instrumentation.wrap_plan, a rule failed when
+    # it added errors to the response
+    __slots__ = ("rule", "record", "form_name")
+
+    def __init__(self, rule, record, form_name):
+        self.rule = rule
+        self.record = record
+        self.form_name = form_name
+
+    def __call__(self, form, response, field_name, validate_function, value):
+        errors = len(response.errors)
+        start = perf_counter()
+        response = self.rule(form, response, field_name, validate_function, value)
+        self.record(
+            self.form_name,
+            field_name,
+            validate_function,
+            perf_counter() - start,
+            len(response.errors) != errors,
+        )
+        return response
+
+
+class Instrumentation:
+    # call counts, failure counts and latency histograms per (form_name,
+    # field_name, rule) for validate, and for generate_csrf and validate_token
+    # under (None, "csrf_token", method). sink, when set, is called with
+    # (form_name, field_name, rule, seconds, failed) after every call.
+    # histogram buckets are upper bounds in seconds
+    buckets = (
+        1e-6,
+        2.5e-6,
+        5e-6,
+        1e-5,
+        2.5e-5,
+        5e-5,
+        1e-4,
+        2.5e-4,
+        5e-4,
+        1e-3,
+        2.5e-3,
+        5e-3,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        float("inf"),
+    )
+
+    # wrapped rules kept for this many (form_name, field rules) pairs
+    wrap_cache_size = 1024
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self._stats = {}
+        self._lock = Lock()
+        self._wrapped = OrderedDict()
+
+    def record(self, form_name, field_name, rule, seconds, failed):
+        bucket = bisect_left(self.buckets, seconds)
+        key = (form_name, field_name, rule)
+        with self._lock:
+            try:
+                stats = self._stats[key]
+            except KeyError:
+                stats = self._stats[key] = [0, 0, 0.0, 0.0, [0] * len(self.buckets)]
+            stats[0] += 1
+            if failed:
+                stats[1] += 1
+            stats[2] += seconds
+            if seconds > stats[3]:
+                stats[3] = seconds
+            stats[4][bucket] += 1
+        if self.sink is not None:
+            self.sink(form_name, field_name, rule, seconds, failed)
+
+    def wrap_plan(self, form_name, plan):
+        # wrapped rules are kept per field entry of a plan, so an ad-hoc plan
+        # joined to a form's plan for one call reuses both their wrappers
+        return tuple(
+            (field_name, self.wrap_rules(form_name, rules))
+            for field_name, rules in plan
+        )
+
+    def wrap_rules(self, form_name, rules):
+        key = (form_name, id(rules))
+        try:
+            wrapped_rules, wrapped = self._wrapped[key]
+            # the rules are held by the cache, so their id isn't reused
+            if wrapped_rules is rules:
+                try:
+                    self._wrapped.move_to_end(key)
+                except KeyError:
+                    pass
+                return wrapped
+        except KeyError:
+            pass
+        wrapped = tuple(
+            (TimedRule(rule, self.record, form_name), validate_function, value)
+            for rule, validate_function, value in rules
+        )
+        self._wrapped[key] = (rules, wrapped)
+        while len(self._wrapped) > self.wrap_cache_size:
+            try:
+                self._wrapped.popitem(last=False)
+            except KeyError:
+                break
+        return wrapped
+
+    def stats(self):
+        # {(form_name, field_name, rule): {calls, failures, total_time,
+        # max_time, histogram}}, histogram lists (upper bound, count) for
+        # the buckets that have calls
+        with self._lock:
+            snapshot = [
+                (key, calls, failures, total, most, list(histogram))
+                for key, (calls, failures, total, most, histogram) in (
+                    self._stats.items()
+                )
+            ]
+        return {
+            key: {
+                "calls": calls,
+                "failures": failures,
+                "total_time": total,
+                "mean_time": total / calls,
+                "max_time": most,
+                "histogram": [
+                    (bound, count)
+                    for bound, count in zip(self.buckets, histogram)
+                    if count
+                ],
+            }
+            for key, calls, failures, total, most, histogram in snapshot
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class LazyCsrfInput:
+    # renders the csrf input for templates, the token is only minted when the
+    # template actually outputs it
+    def __init__(self, wolf_forms):
+        self.wolf_forms = wolf_forms
+
+    def __html__(self):
+        return (
+            f'<input name="csrf_token" value="{self.wolf_forms.request_csrf()}" '
+            f'style="display: none">'
+        )
+
+    def __str__(self):
+        return self.__html__()
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
 class Response:
+    __slots__ = ("valid", "errors")
+
     def __init__(self, valid=True, errors=None):
         self.valid = valid
         self.errors = errors or []
@@ -306,13 +1529,105 @@ class Response:
         return f"Valid: {self.valid}\nErrors: {len(self.errors)}"
 
 
+class ColumnarResult:
+    def __init__(self, plan, columns, length):
+        self.plan = plan
+        self.columns = columns
+        self.length = length
+        self.failures = []
+        self.invalid = [False] * length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row_index):
+        return self.response(row_index)
+
+    def __iter__(self):
+        for row_index in range(self.length):
+            yield self.response(row_index)
+
+    def __repr__(self):
+        return f"Rows: {self.length}\nInvalid: {len(self.invalid_rows())}"
+
+    def add_failures(self, field_name, rule, failures):
+        self.failures.append((field_name, rule, failures))
+        if isinstance(self.invalid, list) and isinstance(failures, list):
+            self.invalid = [a or b for a, b in zip(self.invalid, failures)]
+        else:
+            self.invalid = self.invalid | failures
+
+    @property
+    def valid(self):
+        return [not invalid for invalid in self.invalid]
+
+    def invalid_rows(self):
+        return [i for i, invalid in enumerate(self.invalid) if invalid]
+
+    def row(self, row_index):
+        row = {}
+        for field_name, column in self.columns.items():
+            value = column[row_index]
+            # numpy scalars become python values, as from ndarray.tolist()
+            item = getattr(value, "item", None)
+            row[field_name] = item() if item else value
+        for field_name, rules in self.plan:
+            row.setdefault(field_name, "")
+        return row
+
+    def response(self, row_index):
+        response = Response()
+        if not self.invalid[row_index]:
+            return response
+
+        # rerun only the rules that failed for this row to build its errors
+        row = self.row(row_index)
+        for field_name, rule, failures in self.failures:
+            if failures[row_index]:
+                validate_class_method, validate_function, value = rule
+                response = validate_class_method(
+                    row, response, field_name, validate_function, value
+                )
+        return response
+
+    def errors(self, row_index):
+        return self.response(row_index).errors
+
+
 class Error:
-    def __init__(self, error=None, field_name=None, validate_function=None, value=None):
-        self.error = error
+    # message is a str.format template rendered with field_name,
+    # validate_function and value the first time error is read, so errors
+    # nobody looks at are never formatted
+    __slots__ = ("_error", "message", "field_name", "validate_function", "value")
+
+    def __init__(
+        self,
+        error=None,
+        field_name=None,
+        validate_function=None,
+        value=None,
+        message=None,
+    ):
+        self._error = error
+        self.message = message
         self.field_name = field_name
         self.validate_function = validate_function
         self.value = value
 
+    @property
+    def error(self):
+        if self._error is None and self.message is not None:
+            self._error = self.message.format(
+                field_name=self.field_name,
+                validate_function=self.validate_function,
+                value=self.value,
+            )
+        return self._error
+
+    @error.setter
+    def error(self, error):
+        self._error = error
+
     def __repr__(self):
         return (
             f"{self.error} in {self.field_name}. {self.validate_function} "
@@ -328,3 +1643,564 @@ py_types = {
     "dict": dict,
     "bool": bool,
 }
+
+
+def check_form(form_name, validators):
+    if not isinstance(form_name, str):
+        raise Exception("form_name must be a string")
+
+    if not isinstance(validators, list):
+        raise Exception("Validators must be a list")
+
+    if len(validators) < 1:
+        raise Exception("You must have at least one validator for the form")
+
+    for validator in validators:
+        if not isinstance(validator, dict):
+            raise Exception("Each validator must be a dict")
+        field_name = f"{next(iter(validator))}"
+        if not isinstance(field_name, str):
+            raise Exception("field_name must be a string")
+        if not isinstance(validator[field_name], dict):
+            raise Exception("Validator field methods must be a dict")
+
+
+def form_files(paths):
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                sorted(
+                    os.path.join(path, name)
+                    for name in os.listdir(path)
+                    if name.endswith(".json")
+                )
+            )
+        else:
+            files.append(os.fspath(path))
+    return files
+
+
+def files_signature(files):
+    signature = []
+    for file in files:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            signature.append((file, None, None))
+        else:
+            signature.append((file, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+form_artifact_version = f"wolf_forms-2-{marshal.version}"
+
+
+def load_form_artifact(files, cache_dir=None):
+    # {"forms": {form_name: validators}} for the files, read from or saved to
+    # cache_dir keyed by a sha256 of the files' names and contents
+    contents = []
+    import json
+    from hashlib import sha256
+
+    digest = sha256(form_artifact_version.encode())
+    for file in files:
+        with open(file, "rb") as f:
+            data = f.read()
+        digest.update(f"{file}\0{len(data)}\0".encode())
+        digest.update(data)
+        contents.append((file, data))
+
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"forms-{digest.hexdigest()}.marshal")
+        try:
+            with open(cache_path, "rb") as f:
+                artifact = marshal.load(f)
+            # only plain data is cached, it is checked like a file's forms
+            for form_name, validators in artifact["forms"].items():
+                check_form(form_name, validators)
+            return artifact
+        except Exception:
+            pass
+
+    forms = {}
+    for file, data in contents:
+        try:
+            file_forms = json.loads(data)
+        except ValueError as e:
+            raise Exception(f"Could not load forms from {file}, error was: {e}")
+        if not isinstance(file_forms, dict):
+            raise Exception(f"{file} must map form names to validators")
+        for form_name, validators in file_forms.items():
+            if form_name in forms:
+                raise Exception(f"Form: {form_name} is defined more than once")
+            check_form(form_name, validators)
+            forms[form_name] = validators
+
+    artifact = {"forms": forms}
+    if cache_path:
+        # written under a temporary name and renamed, so other workers never
+        # read a partial file. the cache is best effort, a cache_dir that
+        # can't be written to only means the next start does the work again
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                marshal.dump(artifact, f)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+    return artifact
+
+
+def validate_cache_key(form, form_name, plan, fail_fast):
+    # the submitted values of the plan's fields, except csrf_token, with
+    # their types so 1, 1.0 and True don't share a result. None when a value
+    # can't be hashed
+    values = tuple(
+        (type(value), value)
+        for value in (
+            form.get(field_name, "")
+            for field_name, rules in plan
+            if field_name != "csrf_token"
+        )
+    )
+    key = (form_name, fail_fast, values)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def plan_key(value):
+    # hashable key of a validators structure for the ad-hoc plan cache. every
+    # value is paired with its type so 1 and True differ, patterns are keyed
+    # by (pattern, flags). raises TypeError for values that can't be hashed
+    if isinstance(value, dict):
+        return (dict, tuple((plan_key(k), plan_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(plan_key(item) for item in value))
+    if isinstance(value, re.Pattern):
+        return (re.Pattern, value.pattern, value.flags)
+    hash(value)
+    return (type(value), value)
+
+
+def index_plan(plan):
+    # field_name -> (rule groups, pure) for validate_field, one group of
+    # rules for each time the field is in the plan
+    index = {}
+    for field_name, rules in plan:
+        groups, pure = index.get(field_name, ((), True))
+        pure = pure and all(
+            is_builtin_rule(validate_class_method, validate_function)
+            for validate_class_method, validate_function, value in rules
+        )
+        index[field_name] = (groups + (rules,), pure)
+    return index
+
+
+def compile_parse_plan(validators):
+    # (field_name, type, required, (max_length, max_items, item_type)) for
+    # each field, used by parse_form
+    parse_plan = []
+    for validator in validators:
+        field_name = f"{next(iter(validator))}"
+        methods = validator[field_name]
+        limits = (
+            methods.get("max_length"),
+            methods.get("max_items"),
+            methods.get("item_type"),
+        )
+        parse_plan.append(
+            (field_name, methods.get("type"), methods.get("required"), limits)
+        )
+    return tuple(parse_plan)
+
+
+def iter_list_chunks(value, chunk_size=65536):
+    # split a comma separated string about chunk_size characters at a time, so
+    # only one chunk of items exists as separate strings at once
+    start = 0
+    while True:
+        end = value.find(",", start + chunk_size)
+        if end == -1:
+            yield value[start:].split(",")
+            return
+        yield value[start:end].split(",")
+        start = end + 1
+
+
+def iter_list_items(value, convert=None):
+    for chunk in iter_list_chunks(value):
+        yield from map(convert, chunk) if convert else chunk
+
+
+# list item types stored in a compact array instead of a list of objects
+array_typecodes = {"int": "q", "float": "d"}
+
+
+def parse_bool(value):
+    if value.lower() == "true":
+        return True
+    elif value.lower() == "false":
+        return False
+    raise ValueError(f"Could not convert {value} to bool")
+
+
+# item types item_type can check, (type of parsed items, conversion of the
+# items of a submitted string)
+item_types = {
+    "str": (str, str),
+    "int": (int, int),
+    "float": (float, float),
+    "bool": (bool, parse_bool),
+}
+
+
+# item types that parse_value converts list items to
+parsed_item_types = ("int", "float", "bool")
+
+
+def compile_item_type(value):
+    try:
+        return item_types[value]
+    except (KeyError, TypeError):
+        raise Exception(
+            f"Invalid item_type [{value}]: must be one of {', '.join(item_types)}"
+        )
+
+
+def parse_value(value, type_name, item_type=None, lazy=False):
+    if type_name == "dict":
+        import json
+
+        value = json.loads(value)
+        return value if isinstance(value, dict) else dict(value)
+    if type_name == "list":
+        # items are converted like item_type checks them, so bool items are
+        # only true or false
+        convert = item_types[item_type][1] if item_type in parsed_item_types else None
+        if lazy:
+            return iter_list_items(value, convert)
+        if item_type in array_typecodes:
+            items = array(array_typecodes[item_type])
+            for chunk in iter_list_chunks(value):
+                items.extend(map(convert, chunk))
+            return items
+        if convert:
+            return list(iter_list_items(value, convert))
+        return value.split(",")
+    if type_name == "bool":
+        return parse_bool(value)
+    if type_name in py_types:
+        return py_types[type_name](value)
+    # types that only validate (e.g. email) are left as they are
+    return value
+
+
+email_regex = re.compile(r"^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$")
+
+
+@lru_cache(maxsize=512)
+def compile_regex(pattern):
+    # returns the fastest equivalent of re.search for the pattern (a string or
+    # a compiled re.Pattern). patterns anchored with ^ or \A only need match,
+    # and ones also ending in \Z can use fullmatch.
+    if not isinstance(pattern, re.Pattern):
+        pattern = re.compile(pattern)
+    if not isinstance(pattern.pattern, str) or pattern.flags & re.MULTILINE:
+        return pattern.search
+
+    try:
+        parsed = list(_regex_parser.parse(pattern.pattern, pattern.flags))
+    except Exception:
+        return pattern.search
+    at_beginning = (_regex_constants.AT_BEGINNING, _regex_constants.AT_BEGINNING_STRING)
+    if not parsed or parsed[0] not in [
+        (_regex_constants.AT, at) for at in at_beginning
+    ]:
+        return pattern.search
+    if parsed[-1] == (_regex_constants.AT, _regex_constants.AT_END_STRING):
+        return pattern.fullmatch
+    return pattern.match
+
+
+expression_nodes = (
+    ast.Expression,
+    ast.BoolOp,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Compare,
+    ast.IfExp,
+    ast.Call,
+    ast.keyword,
+    ast.Attribute,
+    ast.Subscript,
+    ast.Slice,
+    ast.Name,
+    ast.Constant,
+    ast.Tuple,
+    ast.List,
+    ast.Set,
+    ast.Dict,
+    ast.Load,
+    ast.boolop,
+    ast.operator,
+    ast.unaryop,
+    ast.cmpop,
+)
+
+expression_globals = {"__builtins__": {}}
+
+# str.format and format_map read attributes named in the format string, e.g.
+# "{0.__class__}", which gets past the private attribute check
+denied_expression_attributes = frozenset(("format", "format_map"))
+
+
+@lru_cache(maxsize=512)
+def compile_expression(source):
+    # expressions are evaluated with only field_value in scope and no builtins,
+    # calls are limited to non private methods, e.g. field_value.isdigit()
+    if not isinstance(source, str):
+        raise Exception(f"Invalid expression [{source}]: must be a string")
+
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as e:
+        raise Exception(f"Invalid expression [{source}]: {e}")
+
+    for node in ast.walk(tree):
+        if not isinstance(node, expression_nodes):
+            raise Exception(
+                f"Invalid expression [{source}]: {type(node).__name__} is not allowed"
+            )
+        if isinstance(node, ast.Name) and node.id != "field_value":
+            raise Exception(
+                f"Invalid expression [{source}]: only field_value can be used, "
+                f"not {node.id}"
+            )
+        if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+            raise Exception(
+                f"Invalid expression [{source}]: private attribute {node.attr}"
+            )
+        if (
+            isinstance(node, ast.Attribute)
+            and node.attr in denied_expression_attributes
+        ):
+            raise Exception(
+                f"Invalid expression [{source}]: {node.attr} is not allowed"
+            )
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Attribute):
+            raise Exception(
+                f"Invalid expression [{source}]: only methods of values can be called"
+            )
+    return compile(tree, "<expression>", "eval")
+
+
+# relative cost of the built in rules, compiled plans run cheap rules first.
+# custom validate functions default to custom_rule_cost (async_rule_cost for
+# async ones) unless registered with a cost.
+rule_costs = {
+    "class_method_not_found": 0,
+    "required": 1,
+    "min_length": 1,
+    "max_length": 1,
+    "max_items": 1,
+    "_type": 2,
+    "item_type": 3,
+    "expression": 4,
+    "regex_search": 5,
+}
+custom_rule_cost = 10
+async_rule_cost = 20
+
+# after one of length_rules fails for a field its length_guarded_rules are
+# skipped, in every mode
+length_rules = frozenset(("min_length", "max_length", "max_items"))
+length_guarded_rules = frozenset(("regex_search", "expression"))
+
+
+def length_failed(errors, start):
+    # True when one of errors[start:] is from a length rule
+    return any(
+        error.validate_function in length_rules for error in islice(errors, start, None)
+    )
+
+
+def rule_cost(validate_class_method, validate_function):
+    if isinstance(validate_class_method, AsyncRule):
+        return getattr(validate_class_method.func, "cost", async_rule_cost)
+    if validate_function in rule_costs:
+        return rule_costs[validate_function]
+    if validate_class_method == WolfForms.class_method_not_found:
+        return rule_costs["class_method_not_found"]
+    return getattr(validate_class_method, "cost", custom_rule_cost)
+
+
+def is_builtin_rule(validate_class_method, validate_function):
+    return (
+        validate_function in rule_costs
+        or validate_class_method == WolfForms.class_method_not_found
+    )
+
+
+def order_rules(rules):
+    # cheap built in rules first. custom rules stay where they were declared,
+    # one returning a new Response drops the errors of the rules before it so
+    # built in rules are only reordered between them
+    ordered = []
+    start = 0
+    for i, (validate_class_method, validate_function, value) in enumerate(rules):
+        if not is_builtin_rule(validate_class_method, validate_function):
+            ordered.extend(
+                sorted(rules[start:i], key=lambda rule: rule_cost(rule[0], rule[1]))
+            )
+            ordered.append(rules[i])
+            start = i + 1
+    ordered.extend(sorted(rules[start:], key=lambda rule: rule_cost(rule[0], rule[1])))
+    return tuple(ordered)
+
+
+def fail_fast_plan(plan):
+    # every rule of a field in cost order, custom rules included, for
+    # validate with fail_fast. a failed rule stops the field so a custom rule
+    # can't drop its errors. the plan itself when nothing moves
+    ordered = tuple(
+        (
+            field_name,
+            tuple(sorted(rules, key=lambda rule: rule_cost(rule[0], rule[1]))),
+        )
+        for field_name, rules in plan
+    )
+    if all(a[1] == b[1] for a, b in zip(plan, ordered)):
+        return plan
+    return ordered
+
+
+compiled_rules = {
+    "regex_search": (compile_regex, "_regex_search"),
+    "expression": (compile_expression, "_expression"),
+    "item_type": (compile_item_type, "_item_type"),
+}
+
+
+comparison_operators = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+reflected_operators = {
+    ast.Eq: ast.Eq,
+    ast.NotEq: ast.NotEq,
+    ast.Lt: ast.Gt,
+    ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt,
+    ast.GtE: ast.LtE,
+}
+
+
+@lru_cache(maxsize=512)
+def simple_comparison(source):
+    # (ast operator, constant) for expressions like "field_value > 3" or
+    # "3 < field_value", None for anything else
+    body = ast.parse(source, mode="eval").body
+    if not isinstance(body, ast.Compare) or len(body.ops) != 1:
+        return None
+    left, op, right = body.left, type(body.ops[0]), body.comparators[0]
+    if isinstance(right, ast.Name) and isinstance(left, ast.Constant):
+        if op not in reflected_operators:
+            return None
+        left, op, right = right, reflected_operators[op], left
+    if not (isinstance(left, ast.Name) and left.id == "field_value"):
+        return None
+    try:
+        return op, ast.literal_eval(right)
+    except ValueError:
+        return None
+
+
+numpy_type_kinds = {"int": "iub", "float": "f", "bool": "b"}
+numpy_operators = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def numpy_column_failures(column, rule):
+    # vectorized checks for numeric numpy columns, None when the rule has to
+    # fall back to the python values
+    import numpy
+
+    validate_class_method, validate_function, value = rule
+    if validate_function == "_type" and value in py_types:
+        fails = column.dtype.kind not in numpy_type_kinds.get(value, "")
+        return numpy.full(len(column), fails)
+    if validate_function == "expression":
+        comparison = simple_comparison(value)
+        if comparison and comparison[0] in numpy_operators:
+            op, constant = comparison
+            if isinstance(constant, (int, float)) and not isinstance(constant, bool):
+                return ~comparison_operators[op](column, constant)
+    return None
+
+
+def column_failures(column, rule, field_name, row):
+    # a list (or numpy array) of bools, True where the rule fails for that
+    # row, or None when the rule can't fail. matches running the rule through
+    # validate on each row.
+    validate_class_method, validate_function, value = rule
+    if type(column).__name__ == "ndarray":
+        if column.dtype.kind in "iufb":
+            failures = numpy_column_failures(column, rule)
+            if failures is not None:
+                return failures
+        column = column.tolist()
+
+    if validate_function == "required":
+        if value is not True:
+            return None
+        return [len(field_value) < 1 for field_value in column]
+    if validate_function == "min_length":
+        return [len(field_value) < value for field_value in column]
+    if validate_function == "max_length":
+        return [len(field_value) > value for field_value in column]
+    if validate_function == "_type":
+        if value in py_types:
+            py_type = py_types[value]
+            return [not isinstance(field_value, py_type) for field_value in column]
+        if value == "email":
+            return [not email_regex.match(field_value) for field_value in column]
+        return None
+    if validate_function == "regex_search":
+        matcher = validate_class_method.args[0]
+        return [not matcher(field_value) for field_value in column]
+    if validate_function == "expression":
+        comparison = simple_comparison(value)
+        if comparison:
+            op, constant = comparison
+            op = comparison_operators[op]
+            return [op(field_value, constant) is False for field_value in column]
+        code = validate_class_method.args[0]
+        return [
+            eval(code, expression_globals, {"field_value": field_value}) is False
+            for field_value in column
+        ]
+
+    # custom validate functions get the full row, one row at a time
+    failures = []
+    for row_index in range(len(column)):
+        response = validate_class_method(
+            row(row_index), Response(), field_name, validate_function, value
+        )
+        failures.append(response.valid is False or len(response.errors) > 0)
+    return failures
@@ -0,0 +1,429 @@
+"""
+Benchmarks for the WolfForms hot paths, runs offline with no app server.
+
+    python -m wolf_forms.benchmarks --output before.json
+    python -m wolf_forms.benchmarks --compare before.json
+
+Every result is lower is better, times are seconds per operation (best of
+--repeat runs) and memory is bytes. --compare exits with status 1 when a
+result is more than --threshold slower (or bigger) than the baseline.
+"""
+import gc
+import sys
+import json
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from os import path
+from time import perf_counter, time
+from threading import Thread, Barrier
+from collections import OrderedDict
+
+from . import WolfForms, Instrumentation
+from .stores import MemoryTokenStore, SQLiteTokenStore
+
+# name -> function(options) returning {result_name: (value, unit)}
+benchmarks = OrderedDict()
+
+
+def benchmark(func):
+    benchmarks[func.__name__] = func
+    return func
+
+
+def time_per_op(func, number, repeat):
+    # best of repeat runs, the other runs mostly measure noise
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = perf_counter()
+            for _ in range(number):
+                func()
+            elapsed = (perf_counter() - start) / number
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def make_wolf_forms(options, **kwargs):
+    wolf_forms = WolfForms(**kwargs)
+    wolf_forms.bcrypt._log_rounds = options.bcrypt_rounds
+    return wolf_forms
+
+
+# one field per built in rule, large_form repeats them
+small_validators = [
+    {"username": {"required": True, "min_length": 3, "max_length": 20}},
+    {"email": {"required": True, "type": "email"}},
+    {"age": {"type": "int"}},
+]
+small_form = {"username": "ross", "email": "ross@wolf.com", "age": 30}
+
+rule_validators = [
+    {"name": {"required": True, "min_length": 2, "max_length": 40}},
+    {"email": {"type": "email"}},
+    {"code": {"regex_search": "^[A-Z]{3}-[0-9]{4}$"}},
+    {"count": {"type": "int", "expression": "0 <= field_value < 1000"}},
+    {"tags": {"type": "str", "max_items": 10, "item_type": "int"}},
+]
+rule_form = {
+    "name": "Ross Mountjoy",
+    "email": "ross@wolf.com",
+    "code": "ABC-1234",
+    "count": 30,
+    "tags": "1,2,3,4,5",
+}
+invalid_rule_form = {
+    "name": "R",
+    "email": "not an email",
+    "code": "abc",
+    "count": 5000,
+    "tags": "1,2,three",
+}
+
+
+def large(validators, form, copies=10):
+    large_validators = []
+    large_form = {}
+    for copy in range(copies):
+        for validator in validators:
+            for field_name, rules in validator.items():
+                large_validators.append({f"{field_name}_{copy}": rules})
+        for field_name, value in form.items():
+            large_form[f"{field_name}_{copy}"] = value
+    return large_validators, large_form
+
+
+parse_validators = [
+    {"count": {"type": "int"}},
+    {"price": {"type": "float"}},
+    {"agree": {"type": "bool"}},
+    {"ids": {"type": "list", "item_type": "int"}},
+    {"names": {"type": "list"}},
+    {"options": {"type": "dict"}},
+]
+parse_form = {
+    "count": "30",
+    "price": "9.99",
+    "agree": "true",
+    "ids": ",".join(str(i) for i in range(100)),
+    "names": "ross,wolf,forms",
+    "options": '{"color": "blue", "size": 3}',
+}
+
+
+@benchmark
+def csrf(options):
+    results = {}
+    wolf_forms = make_wolf_forms(options)
+    results["generate_csrf"] = time_per_op(wolf_forms.generate_csrf, 5, options.repeat)
+    token = wolf_forms.generate_csrf()
+    results["validate_token"] = time_per_op(
+        lambda: wolf_forms.validate_token(token), 5, options.repeat
+    )
+
+    wolf_forms = make_wolf_forms(options, signed_csrf=True, secret_key="benchmark")
+    results["generate_signed_csrf"] = time_per_op(
+        wolf_forms.generate_csrf, 2000, options.repeat
+    )
+    token = wolf_forms.generate_csrf()
+    results["validate_signed_token"] = time_per_op(
+        lambda: wolf_forms.validate_token(token), 2000, options.repeat
+    )
+    return {name: (value, "s") for name, value in results.items()}
+
+
+@benchmark
+def validate(options):
+    wolf_forms = make_wolf_forms(options)
+    large_validators, large_form = large(rule_validators, rule_form)
+    _, invalid_large_form = large(rule_validators, invalid_rule_form)
+    wolf_forms.add_form("small", small_validators)
+    wolf_forms.add_form("large", large_validators)
+
+    cases = {
+        "validate_small": ("small", small_form, 2000),
+        "validate_large": ("large", large_form, 200),
+        "validate_large_invalid": ("large", invalid_large_form, 200),
+    }
+    results = {}
+    for name, (form_name, form, number) in cases.items():
+        results[name] = (
+            time_per_op(
+                lambda: wolf_forms.validate(dict(form), form_name),
+                number,
+                options.repeat,
+            ),
+            "s",
+        )
+        results[f"{name}_fail_fast"] = (
+            time_per_op(
+                lambda: wolf_forms.validate(dict(form), form_name, fail_fast=True),
+                number,
+                options.repeat,
+            ),
+            "s",
+        )
+    wolf_forms.instrumentation = Instrumentation()
+    results["validate_large_instrumented"] = (
+        time_per_op(
+            lambda: wolf_forms.validate(dict(large_form), "large"),
+            200,
+            options.repeat,
+        ),
+        "s",
+    )
+    wolf_forms.instrumentation = None
+    wolf_forms.validate_cache_size = 128
+    results["validate_large_cached"] = (
+        time_per_op(
+            lambda: wolf_forms.validate(dict(large_form), "large"),
+            200,
+            options.repeat,
+        ),
+        "s",
+    )
+    wolf_forms.validate_cache_size = None
+    results["validate_field"] = (
+        time_per_op(
+            lambda: wolf_forms.validate_field("large", "name_0", "Ross"),
+            2000,
+            options.repeat,
+        ),
+        "s",
+    )
+    return results
+
+
+@benchmark
+def parse(options):
+    wolf_forms = make_wolf_forms(options)
+    wolf_forms.add_form("parse", parse_validators)
+    results = {
+        "parse_form": time_per_op(
+            lambda: wolf_forms.parse_form(parse_form, "parse"), 1000, options.repeat
+        ),
+        "validate_and_parse": time_per_op(
+            lambda: wolf_forms.validate_and_parse(parse_form, "parse"),
+            1000,
+            options.repeat,
+        ),
+    }
+    return {name: (value, "s") for name, value in results.items()}
+
+
+def contention(store, threads, operations):
+    # every thread adds, reads and deletes its own tokens against one store,
+    # returns the wall clock seconds per operation over all threads
+    barrier = Barrier(threads + 1)
+    expires_at = time() + 600
+
+    def worker():
+        barrier.wait()
+        for _ in range(operations):
+            token_id = store.add(b"$2b$04$" + b"x" * 53, expires_at)
+            store.get(token_id)
+            store.delete(token_id)
+
+    workers = [Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = perf_counter()
+    for thread in workers:
+        thread.join()
+    return (perf_counter() - start) / (threads * operations * 3)
+
+
+@benchmark
+def token_store(options):
+    results = {}
+    for threads in (1, options.threads):
+        results[f"memory_store_{threads}_threads"] = (
+            min(
+                contention(MemoryTokenStore(), threads, 2000)
+                for _ in range(options.repeat)
+            ),
+            "s",
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteTokenStore(path.join(directory, "tokens.db"))
+            results[f"sqlite_store_{threads}_threads"] = (
+                min(contention(store, threads, 50) for _ in range(options.repeat)),
+                "s",
+            )
+    return results
+
+
+def import_seconds(statement):
+    # cumulative -X importtime of wolf_forms in a fresh interpreter
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=path.dirname(path.dirname(path.abspath(__file__))),
+    ).stderr
+    for line in output.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "wolf_forms":
+            return int(fields[1]) / 1e6
+    raise Exception(f"wolf_forms not imported by {statement}")
+
+
+@benchmark
+def startup(options):
+    return {
+        "import_wolf_forms": (
+            min(import_seconds("import wolf_forms") for _ in range(options.repeat)),
+            "s",
+        )
+    }
+
+
+def memory_per_token(wolf_forms, tokens):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [wolf_forms.generate_csrf() for _ in range(tokens)]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # the returned token strings are the client's, not held by the store
+    return (held - sum(sys.getsizeof(token) for token in kept)) / tokens
+
+
+@benchmark
+def memory(options):
+    return {
+        "bytes_per_token": (memory_per_token(make_wolf_forms(options), 500), "bytes"),
+        "bytes_per_token_capped": (
+            memory_per_token(make_wolf_forms(options, csrf_capacity=100), 500),
+            "bytes",
+        ),
+    }
+
+
+def run(options):
+    results = {}
+    for name, func in benchmarks.items():
+        if options.filter and not any(f in name for f in options.filter):
+            continue
+        for result_name, (value, unit) in func(options).items():
+            results[result_name] = {"value": value, "unit": unit}
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "bcrypt_rounds": options.bcrypt_rounds,
+            "repeat": options.repeat,
+            "threads": options.threads,
+            "created": time(),
+        },
+        "results": results,
+    }
+
+
+def format_value(value, unit):
+    if unit == "s":
+        for scale, suffix in ((1, "s"), (1e-3, "ms"), (1e-6, "us")):
+            if value >= scale:
+                return f"{value / scale:.2f} {suffix}"
+        return f"{value / 1e-9:.0f} ns"
+    return f"{value:.0f} {unit}"
+
+
+def compare(baseline, current, threshold):
+    # returns the printable rows and the names of regressed results
+    rows = []
+    regressions = []
+    for name, result in current["results"].items():
+        unit = result["unit"]
+        old = baseline["results"].get(name)
+        if old is None or old["unit"] != unit or not old["value"]:
+            rows.append((name, "-", format_value(result["value"], unit), "new"))
+            continue
+        change = result["value"] / old["value"] - 1
+        status = f"{change:+.1%}"
+        if change > threshold:
+            status += " REGRESSION"
+            regressions.append(name)
+        rows.append(
+            (
+                name,
+                format_value(old["value"], unit),
+                format_value(result["value"], unit),
+                status,
+            )
+        )
+    return rows, regressions
+
+
+def print_rows(rows):
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m wolf_forms.benchmarks", description=__doc__.split("\n")[1]
+    )
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--compare", help="baseline json file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown that counts as a regression, default 0.1 (10%%)",
+    )
+    parser.add_argument(
+        "--filter",
+        action="append",
+        help="only run benchmarks whose name contains this, can be repeated",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+        "--bcrypt-rounds",
+        type=int,
+        default=4,
+        help="bcrypt log rounds for csrf tokens, default 4 (the minimum)",
+    )
+    options = parser.parse_args(argv)
+
+    current = run(options)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if not options.compare:
+        print_rows(
+            [("benchmark", "result")]
+            + [
+                (name, format_value(result["value"], result["unit"]))
+                for name, result in current["results"].items()
+            ]
+        )
+        return 0
+
+    with open(options.compare) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("bcrypt_rounds") != options.bcrypt_rounds:
+        print("warning: baseline used different bcrypt rounds", file=sys.stderr)
+    rows, regressions = compare(baseline, current, options.threshold)
+    print_rows([("benchmark", "baseline", "current", "change")] + rows)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+CSRF token stores for WolfForms.
+
+A token store keeps the hashed csrf tokens and their expiry times. Every store
+allocates the token_id when a token is added, so ids never collide between
+workers sharing a store. expires_at is a unix timestamp (time.time()).
+"""
+import threading
+from collections import OrderedDict
+from heapq import heappush, heappop, heapify
+from itertools import count
+from time import time
+
+
+class TokenStore:
+    # False for stores whose server expires tokens, WolfForms then doesn't
+    # run its expiry scheduler for them
+    expires_locally = True
+
+    def add(self, hashed_token, expires_at):
+        raise NotImplementedError
+
+    def get(self, token_id):
+        raise NotImplementedError
+
+    def delete(self, token_id):
+        raise NotImplementedError
+
+    def get_many(self, token_ids):
+        return [self.get(token_id) for token_id in token_ids]
+
+    def delete_many(self, token_ids):
+        for token_id in token_ids:
+            self.delete(token_id)
+
+    def expire(self, now):
+        # bulk remove every token with expires_at <= now, returns the count
+        return 0
+
+    def next_expiry(self):
+        # earliest expires_at in the store, None when nothing needs expiring
+        return None
+
+
+class MemoryTokenStore(TokenStore):
+    def __init__(self, capacity=None):
+        # token_id -> (hashed_token, expires_at). ids come from a monotonic
+        # counter, next() on itertools.count is atomic so allocation needs no
+        # lock and ids are never reused after an expiry.
+        # with a capacity the least recently used tokens are evicted first.
+        self.tokens = OrderedDict()
+        self.capacity = capacity
+        self._token_ids = count(1)
+        self._expiry_heap = []
+        self._heap_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, hashed_token, expires_at):
+        token_id = next(self._token_ids)
+        self.tokens[token_id] = (hashed_token, expires_at)
+        if self.capacity is not None:
+            while len(self.tokens) > self.capacity:
+                try:
+                    self.tokens.popitem(last=False)
+                except KeyError:
+                    break
+                self.evictions += 1
+        with self._heap_lock:
+            heappush(self._expiry_heap, (expires_at, token_id))
+            if self.capacity is not None and len(self._expiry_heap) > 2 * self.capacity:
+                # drop heap entries of evicted tokens so the heap stays bounded
+                self._expiry_heap = [
+                    (expires_at, token_id)
+                    for token_id, (_, expires_at) in list(self.tokens.items())
+                ]
+                heapify(self._expiry_heap)
+        return token_id
+
+    def get(self, token_id):
+        record = self.tokens.get(token_id)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.capacity is not None:
+            try:
+                self.tokens.move_to_end(token_id)
+            except KeyError:
+                pass
+        return record
+
+    def delete(self, token_id):
+        self.tokens.pop(token_id, None)
+
+    def stats(self):
+        return {
+            "live": len(self.tokens),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def expire(self, now):
+        expired = 0
+        with self._heap_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, token_id = heappop(self._expiry_heap)
+                if self.tokens.pop(token_id, None) is not None:
+                    expired += 1
+        return expired
+
+    def next_expiry(self):
+        try:
+            return self._expiry_heap[0][0]
+        except IndexError:
+            return None
+
+
+class SQLiteTokenStore(TokenStore):
+    # shares tokens between workers on one host through a sqlite database file
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS csrf_tokens ("
+                "token_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "hashed_token BLOB NOT NULL, "
+                "expires_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS csrf_tokens_expires_at "
+                "ON csrf_tokens (expires_at)"
+            )
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, keep one each
+        db = getattr(self._local, "db", None)
+        if db is None:
+            import sqlite3
+
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def __len__(self):
+        return (
+            self._connection().execute("SELECT COUNT(*) FROM csrf_tokens").fetchone()[0]
+        )
+
+    def add(self, hashed_token, expires_at):
+        with self._connection() as db:
+            cursor = db.execute(
+                "INSERT INTO csrf_tokens (hashed_token, expires_at) VALUES (?, ?)",
+                (hashed_token, expires_at),
+            )
+        return cursor.lastrowid
+
+    def get(self, token_id):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT hashed_token, expires_at FROM csrf_tokens WHERE token_id = ?",
+                (token_id,),
+            )
+            .fetchone()
+        )
+        return tuple(row) if row else None
+
+    def get_many(self, token_ids):
+        token_ids = list(token_ids)
+        if not token_ids:
+            return []
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT token_id, hashed_token, expires_at FROM csrf_tokens "
+                f"WHERE token_id IN ({', '.join('?' * len(token_ids))})",
+                token_ids,
+            )
+            .fetchall()
+        )
+        records = {row[0]: (row[1], row[2]) for row in rows}
+        return [records.get(token_id) for token_id in token_ids]
+
+    def delete(self, token_id):
+        self.delete_many([token_id])
+
+    def delete_many(self, token_ids):
+        with self._connection() as db:
+            db.executemany(
+                "DELETE FROM csrf_tokens WHERE token_id = ?",
+                [(token_id,) for token_id in token_ids],
+            )
+
+    def expire(self, now):
+        with self._connection() as db:
+            cursor = db.execute("DELETE FROM csrf_tokens WHERE expires_at <= ?", (now,))
+        return cursor.rowcount
+
+    def next_expiry(self):
+        return (
+            self._connection()
+            .execute("SELECT MIN(expires_at) FROM csrf_tokens")
+            .fetchone()[0]
+        )
+
+
+class KeyValueTokenStore(TokenStore):
+    # adapter for a networked key-value server with a redis-py style client,
+    # it needs incr, set(px=...), get, delete and pipeline().execute().
+    # keys expire on the server so there is nothing to expire locally.
+    expires_locally = False
+
+    def __init__(self, client, prefix="wolf_forms:csrf:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, token_id):
+        return f"{self.prefix}{token_id}"
+
+    @staticmethod
+    def _load(value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = value.encode()
+        expires_at, _, hashed_token = value.partition(b":")
+        return hashed_token, float(expires_at)
+
+    def add(self, hashed_token, expires_at):
+        if isinstance(hashed_token, str):
+            hashed_token = hashed_token.encode()
+        token_id = int(self.client.incr(f"{self.prefix}next_id"))
+        ttl_ms = max(int((expires_at - time()) * 1000), 1)
+        self.client.set(
+            self._key(token_id), f"{expires_at!r}:".encode() + hashed_token, px=ttl_ms
+        )
+        return token_id
+
+    def get(self, token_id):
+        return self._load(self.client.get(self._key(token_id)))
+
+    def get_many(self, token_ids):
+        pipe = self.client.pipeline()
+        for token_id in token_ids:
+            pipe.get(self._key(token_id))
+        return [self._load(value) for value in pipe.execute()]
+
+    def delete(self, token_id):
+        self.client.delete(self._key(token_id))
+
+    def delete_many(self, token_ids):
+        pipe = self.client.pipeline()
+        for token_id in token_ids:
+            pipe.delete(self._key(token_id))
+        pipe.execute()
@@ -1,6 +1,78 @@
+import os
+import re
+import asyncio
+import pickle
+import marshal
+from array import array
 import unittest
-from time import sleep
-from . import WolfForms, custom_validate_function, Response, Error
+import tempfile
+import threading
+from time import sleep, time
+from flask import Flask, render_template_string
+from werkzeug.datastructures import MultiDict
+from . import (
+    WolfForms,
+    custom_validate_function,
+    Response,
+    Error,
+    MemoryTokenStore,
+    SQLiteTokenStore,
+    KeyValueTokenStore,
+    compile_regex,
+    compile_expression,
+    Instrumentation,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class DictKeyValueClient:
+    # local stand-in for a redis-py client, just enough for KeyValueTokenStore
+    def __init__(self):
+        self.data = {}
+
+    def _live(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time():
+            del self.data[key]
+            return None
+        return value
+
+    def incr(self, key):
+        value = int(self._live(key) or 0) + 1
+        self.data[key] = (value, None)
+        return value
+
+    def set(self, key, value, px=None):
+        self.data[key] = (value, time() + px / 1000 if px else None)
+
+    def get(self, key):
+        return self._live(key)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self):
+        return DictKeyValuePipeline(self)
+
+
+class DictKeyValuePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def get(self, key):
+        self.commands.append((self.client.get, key))
+
+    def delete(self, key):
+        self.commands.append((self.client.delete, key))
+
+    def execute(self):
+        return [command(key) for command, key in self.commands]
 
 
 class TestWolfForms(unittest.TestCase):
@@ -31,6 +103,227 @@ class TestWolfForms(unittest.TestCase):
         sleep(1)
         self.assertFalse(wolf_forms.validate_token(token))
 
+    def test_expiry_scheduler(self):
+        wolf_forms = WolfForms()
+        threads_before = threading.active_count()
+        tokens = [wolf_forms.generate_csrf() for _ in range(3)]
+        self.assertTrue(threading.active_count() <= threads_before + 1)
+        token = wolf_forms.generate_csrf(ttl=1)
+        self.assertTrue(threading.active_count() <= threads_before + 1)
+        sleep(1.2)
+        self.assertFalse(wolf_forms.validate_token(token))
+        self.assertTrue(len(wolf_forms.token_store) == 3)
+        self.assertTrue(wolf_forms.validate_token(tokens[0]))
+
+    def test_signed_csrf_token(self):
+        wolf_forms = WolfForms(signed_csrf=True, secret_key="secret")
+        token = wolf_forms.generate_csrf()
+        self.assertTrue(wolf_forms.validate_token(token))
+        self.assertTrue(len(wolf_forms.token_store) == 0)
+        form = {"csrf_token": token}
+        response = wolf_forms.validate(form, None, csrf=True)
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+
+        expires_at, nonce, signature = token.split(":")
+        self.assertFalse(wolf_forms.validate_token(f"{expires_at}:{nonce}:fish"))
+        forged = f"{int(expires_at) + 1000}:{nonce}:{signature}"
+        self.assertFalse(wolf_forms.validate_token(forged))
+        self.assertFalse(wolf_forms.validate_token("fish"))
+        self.assertFalse(wolf_forms.validate_token("1:2:\u00e9"))
+        self.assertFalse(wolf_forms.validate_token(f"{expires_at}:\u00e9:{signature}"))
+        response = wolf_forms.validate({"csrf_token": "1:2:\u00e9"}, None, csrf=True)
+        self.assertTrue(response.errors[0].error == "Failed to validate csrf token")
+        other = WolfForms(signed_csrf=True, secret_key="other secret")
+        self.assertFalse(other.validate_token(token))
+
+        # app.secret_key set after init_app is still used
+        app = Flask(__name__)
+        app_wolf_forms = WolfForms(app, signed_csrf=True)
+        app.secret_key = "shared secret"
+        app_token = app_wolf_forms.generate_csrf()
+        other = WolfForms(Flask(__name__), signed_csrf=True)
+        other.app.secret_key = "shared secret"
+        self.assertTrue(other.validate_token(app_token))
+
+        token = wolf_forms.generate_csrf(ttl=1)
+        self.assertTrue(wolf_forms.validate_token(token))
+        sleep(1)
+        self.assertFalse(wolf_forms.validate_token(token))
+
+    def test_token_stores(self):
+        tmp_dir = tempfile.mkdtemp()
+        stores = [
+            MemoryTokenStore(),
+            SQLiteTokenStore(os.path.join(tmp_dir, "tokens.db")),
+            KeyValueTokenStore(DictKeyValueClient()),
+        ]
+        for store in stores:
+            now = time()
+            token_ids = [store.add(b"hash", now + 60) for _ in range(3)]
+            self.assertTrue(len(set(token_ids)) == 3)
+            expiring_id = store.add(b"hash", now + 0.5)
+            self.assertTrue(store.get(token_ids[0])[0] == b"hash")
+            records = store.get_many(token_ids + ["fish"])
+            self.assertTrue(records[-1] is None and records[0][0] == b"hash")
+            store.delete_many(token_ids[:2])
+            self.assertTrue(store.get_many(token_ids[:2]) == [None, None])
+            sleep(0.6)
+            store.expire(time())
+            self.assertTrue(store.get(expiring_id) is None)
+            self.assertTrue(store.get(token_ids[2]) is not None)
+            store.delete(token_ids[2])
+            self.assertTrue(store.get(token_ids[2]) is None)
+
+        # tokens issued by one worker validate on another sharing the store
+        path = os.path.join(tmp_dir, "shared.db")
+        worker_a = WolfForms(token_store=SQLiteTokenStore(path))
+        worker_b = WolfForms(token_store=SQLiteTokenStore(path))
+        token = worker_a.generate_csrf()
+        self.assertTrue(worker_b.validate_token(token))
+        worker_b.expire_csrf(int(token.split(":")[0]))
+        self.assertFalse(worker_a.validate_token(token))
+
+        client = DictKeyValueClient()
+        worker_a = WolfForms(token_store=KeyValueTokenStore(client))
+        worker_b = WolfForms(token_store=KeyValueTokenStore(client))
+        # the server expires the keys, so no expiry scheduler is started
+        scheduled = []
+        worker_a.schedule_expiry = scheduled.append
+        token = worker_a.generate_csrf(ttl=1)
+        self.assertTrue(scheduled == [] and worker_a._expiry_thread is None)
+        self.assertTrue(worker_b.validate_token(token))
+        sleep(1)
+        self.assertFalse(worker_b.validate_token(token))
+
+    def test_concurrent_csrf_tokens(self):
+        app = Flask(__name__)
+        app.config["BCRYPT_LOG_ROUNDS"] = 4
+        wolf_forms = WolfForms(app)
+        failures = []
+
+        def worker():
+            tokens = [wolf_forms.generate_csrf() for _ in range(25)]
+            for token in tokens:
+                if not wolf_forms.validate_token(token):
+                    failures.append(token)
+            for token in tokens[:10]:
+                wolf_forms.expire_csrf(int(token.split(":")[0]))
+                if wolf_forms.validate_token(token):
+                    failures.append(token)
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(len(failures) == 0)
+        self.assertTrue(len(wolf_forms.token_store) == 16 * 15)
+        self.assertTrue(len(set(wolf_forms.token_store.tokens)) == 16 * 15)
+
+    def test_csrf_executor(self):
+        app = Flask(__name__)
+        app.config["BCRYPT_LOG_ROUNDS"] = 4
+        wolf_forms = WolfForms(app, csrf_workers=1, csrf_queue_size=0)
+        token = wolf_forms.generate_csrf()
+        self.assertTrue(wolf_forms.validate_token(token))
+        self.assertTrue(wolf_forms.validate_token_future(token).result())
+        self.assertFalse(wolf_forms.validate_token_future("1:fish").result())
+        self.assertTrue(asyncio.run(wolf_forms.avalidate_token(token)))
+        form = {"csrf_token": token}
+        response = asyncio.run(wolf_forms.avalidate(form, None, csrf=True))
+        self.assertTrue(response.valid is True)
+
+        # with the only slot taken, csrf work is rejected instead of queued
+        release = threading.Event()
+        busy = wolf_forms.submit_csrf_hash(release.wait)
+        self.assertFalse(wolf_forms.validate_token(token))
+        self.assertFalse(wolf_forms.validate_token_future(token).result())
+        with self.assertRaises(Exception):
+            wolf_forms.generate_csrf()
+        release.set()
+        busy.result()
+        self.assertTrue(wolf_forms.validate_token(token))
+
+        stats = wolf_forms.csrf_stats()
+        self.assertTrue(stats["rejected"] == 3 and stats["in_flight"] == 0)
+        self.assertTrue(stats["hashed"] == 8)
+        self.assertTrue(stats["queue_wait_max"] >= stats["queue_wait_mean"] >= 0)
+
+    def test_lazy_csrf_input(self):
+        app = Flask(__name__)
+        app.config["BCRYPT_LOG_ROUNDS"] = 4
+        wolf_forms = WolfForms(app)
+        with app.test_request_context():
+            self.assertTrue(
+                render_template_string("<p>no form</p>") == "<p>no form</p>"
+            )
+        self.assertTrue(len(wolf_forms.token_store) == 0)
+
+        with app.test_request_context():
+            html = render_template_string(
+                "<form>{{ wf_csrf_token }}</form><form>{{ wf_csrf_token }}</form>"
+            )
+        self.assertTrue(len(wolf_forms.token_store) == 1)
+        token = html.split('value="')[1].split('"')[0]
+        self.assertTrue(html.count(token) == 2)
+        self.assertTrue(wolf_forms.validate_token(token))
+
+        with app.test_request_context():
+            html = render_template_string("{{ wf_csrf_token }}")
+        self.assertTrue(len(wolf_forms.token_store) == 2)
+        self.assertTrue(html.startswith('<input name="csrf_token"'))
+
+    def test_csrf_capacity_and_reuse(self):
+        app = Flask(__name__)
+        app.config["BCRYPT_LOG_ROUNDS"] = 4
+        wolf_forms = WolfForms(app, csrf_capacity=3)
+        tokens = [wolf_forms.generate_csrf() for _ in range(5)]
+        self.assertTrue(len(wolf_forms.token_store) == 3)
+        self.assertFalse(wolf_forms.validate_token(tokens[0]))
+        # validating a token marks it as recently used
+        self.assertTrue(wolf_forms.validate_token(tokens[2]))
+        wolf_forms.generate_csrf()
+        self.assertTrue(wolf_forms.validate_token(tokens[2]))
+        self.assertFalse(wolf_forms.validate_token(tokens[3]))
+        stats = wolf_forms.csrf_stats()
+        self.assertTrue(stats["live"] == 3 and stats["evictions"] == 3)
+        self.assertTrue(stats["hits"] == 2 and stats["misses"] == 2)
+
+        token = wolf_forms.generate_csrf(client_key="client")
+        self.assertTrue(wolf_forms.generate_csrf(client_key="client") == token)
+        self.assertTrue(wolf_forms.generate_csrf(client_key="other") != token)
+        self.assertTrue(wolf_forms.csrf_stats()["reused"] == 1)
+        # evicted tokens are not handed out again
+        wolf_forms.generate_csrf()
+        wolf_forms.generate_csrf()
+        self.assertTrue(wolf_forms.generate_csrf(client_key="client") != token)
+
+        # tokens past half their ttl are replaced
+        wolf_forms = WolfForms(signed_csrf=True, csrf_ttl=1)
+        token = wolf_forms.generate_csrf(client_key="client")
+        self.assertTrue(wolf_forms.generate_csrf(client_key="client") == token)
+        sleep(0.6)
+        self.assertTrue(wolf_forms.generate_csrf(client_key="client") != token)
+
+        app = Flask(__name__)
+        app.config["BCRYPT_LOG_ROUNDS"] = 4
+        app.secret_key = "secret"
+        wolf_forms = WolfForms(app, csrf_per_client=True)
+        html = []
+
+        @app.route("/form")
+        def form():
+            return render_template_string("{{ wf_csrf_token }}")
+
+        with app.test_client() as client:
+            html.append(client.get("/form").get_data(as_text=True))
+            html.append(client.get("/form").get_data(as_text=True))
+        with app.test_client() as client:
+            html.append(client.get("/form").get_data(as_text=True))
+        self.assertTrue(html[0] == html[1] and html[0] != html[2])
+        self.assertTrue(len(wolf_forms.token_store) == 2)
+
     def test_add_forms(self):
         self.assertRaises(Exception, self.wolf_forms.add_form, 1, None)
 
@@ -52,6 +345,341 @@ class TestWolfForms(unittest.TestCase):
         self.wolf_forms.add_form("test", validators)
         self.assertTrue(self.wolf_forms.forms["test"][0]["test"]["type"] == "str")
 
+    def test_compiled_plans(self):
+        wolf_forms = WolfForms()
+        validators = [{"test": {"min_length": 2, "type": "str"}}]
+        wolf_forms.add_form("test_form", validators)
+        plan = wolf_forms.get_plan("test_form")
+        self.assertTrue(plan[0][0] == "test")
+        self.assertTrue([rule[1] for rule in plan[0][1]] == ["min_length", "_type"])
+
+        adhoc = [{"other": {"max_length": 1}}]
+        response = wolf_forms.validate({"test": "ab", "other": "ab"}, None, adhoc)
+        self.assertTrue(response.errors[0].validate_function == "max_length")
+        self.assertTrue(
+            wolf_forms.get_adhoc_plan(adhoc) is wolf_forms.get_adhoc_plan(adhoc)
+        )
+
+        # patterns with the same long prefix don't share a plan
+        prefix = "a" * 300
+        p1 = [{"other": {"regex_search": re.compile(prefix + "b")}}]
+        p2 = [{"other": {"regex_search": re.compile(prefix + "c")}}]
+        self.assertTrue(repr(p1) == repr(p2))
+        self.assertFalse(wolf_forms.validate({"other": prefix + "c"}, None, p1).valid)
+        self.assertTrue(wolf_forms.validate({"other": prefix + "c"}, None, p2).valid)
+        self.assertTrue(
+            wolf_forms.get_adhoc_plan([{"other": {"required": True}}])
+            is not wolf_forms.get_adhoc_plan([{"other": {"required": 1}}])
+        )
+        unhashable = [{"other": {"is_fishy": {1}}}]
+        self.assertTrue(
+            wolf_forms.get_adhoc_plan(unhashable)
+            is not wolf_forms.get_adhoc_plan(unhashable)
+        )
+        response = wolf_forms.validate({"test": "ab", "other": "a"}, "test_form", adhoc)
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+
+        # validate functions registered after add_form are picked up
+        validators = [{"test": {"is_fishy": True}}]
+        wolf_forms.add_form("fishy_form", validators)
+        response = wolf_forms.validate({"test": "cat"}, "fishy_form")
+        self.assertTrue(
+            response.errors[0].error == "is_fishy is not a valid validate function"
+        )
+
+        @custom_validate_function(WolfForms)
+        def is_fishy(form, response, field_name, validate_function, value):
+            if "fish" not in form.get(field_name):
+                response.valid = False
+                response.errors.append(Error("Not fishy", field_name=field_name))
+            return response
+
+        response = wolf_forms.validate({"test": "cat"}, "fishy_form")
+        self.assertTrue(response.errors[0].error == "Not fishy")
+
+    def test_avalidate(self):
+        @custom_validate_function(WolfForms)
+        async def is_available(form, response, field_name, validate_function, value):
+            await asyncio.sleep(value)
+            if form.get(field_name) == "taken":
+                response.valid = False
+                response.errors.append(
+                    Error(
+                        f"{field_name} is taken",
+                        field_name=field_name,
+                        validate_function=validate_function,
+                        value=value,
+                    )
+                )
+            return response
+
+        validators = [
+            {"username": {"max_length": 4, "is_available": 0.2}},
+            {"coupon": {"is_available": 0.2}},
+        ]
+        self.wolf_forms.add_form("async_form", validators)
+        self.assertRaises(
+            Exception,
+            self.wolf_forms.validate,
+            {"username": "ross", "coupon": "x"},
+            "async_form",
+        )
+
+        form = {"username": "ross", "coupon": "free"}
+        started = time()
+        response = asyncio.run(self.wolf_forms.avalidate(form, "async_form"))
+        self.assertTrue(time() - started < 0.35)
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+
+        form = {"username": "taken", "coupon": "taken"}
+        response = asyncio.run(self.wolf_forms.avalidate(form, "async_form"))
+        self.assertTrue(
+            [e.error for e in response.errors]
+            == [
+                "username can't be more than [4] characters",
+                "username is taken",
+                "coupon is taken",
+            ]
+        )
+
+        validators = [{"username": {"is_available": 5}}]
+        response = asyncio.run(
+            self.wolf_forms.avalidate(
+                {"username": "ross"}, None, validators, timeout=0.1
+            )
+        )
+        self.assertTrue(
+            response.errors[0].error == "username timed out in is_available"
+        )
+
+    def test_validate_many(self):
+        validators = [
+            {"name": {"required": True, "max_length": 5}},
+            {"code": {"regex_search": "^[0-9]+$"}},
+            {"flag": {"expression": "field_value in ('yes', 'no')"}},
+        ]
+        self.wolf_forms.add_form("batch_form", validators)
+        rows = [
+            {"name": "ross", "code": "123", "flag": "yes"},
+            {"name": "", "code": "abc", "flag": "yes"},
+            {"name": "too long", "code": "1", "flag": "maybe"},
+        ] * 40
+
+        expected = [self.wolf_forms.validate(dict(row), "batch_form") for row in rows]
+        for workers in (None, 2):
+            results = self.wolf_forms.validate_many(
+                [dict(row) for row in rows], "batch_form", workers=workers, chunk_size=7
+            )
+            self.assertTrue(len(results) == len(rows))
+            for result, response in zip(results, expected):
+                self.assertTrue(result.valid == response.valid)
+                self.assertTrue(
+                    [e.error for e in result.errors]
+                    == [e.error for e in response.errors]
+                )
+
+        streamed = self.wolf_forms.iter_validate(
+            (dict(row) for row in rows), "batch_form", workers=2, chunk_size=16
+        )
+        self.assertTrue([r.valid for r in streamed] == [r.valid for r in expected])
+        self.assertRaises(
+            Exception, self.wolf_forms.validate_many, rows, "missing_form"
+        )
+
+    def test_validate_columns(self):
+        validators = [
+            {"name": {"required": True, "min_length": 2, "max_length": 5}},
+            {"email": {"type": "email"}},
+            {"age": {"type": "int", "expression": "field_value >= 18"}},
+            {"code": {"regex_search": "^[0-9]+$", "expression": "field_value != '0'"}},
+            {"note": {"type": "str"}},
+        ]
+        self.wolf_forms.add_form("columns_form", validators)
+        columns = {
+            "name": ["ross", "", "r", "too long", "ok"] * 20,
+            "email": ["ross@wolf.com", "fish", "cd@ef.org", "ef@gh.net", "x"] * 20,
+            "age": [30, 12, True, 18, 40] * 20,
+            "code": ["123", "0", "abc", "7", "9"] * 20,
+        }
+        result = self.wolf_forms.validate_columns(columns, "columns_form")
+        self.assertTrue(len(result) == 100)
+        for row_index in range(len(result)):
+            row = {name: column[row_index] for name, column in columns.items()}
+            expected = self.wolf_forms.validate(row, "columns_form")
+            response = result[row_index]
+            self.assertTrue(result.valid[row_index] == expected.valid)
+            self.assertTrue(response.valid == expected.valid)
+            self.assertTrue(
+                [repr(e) for e in response.errors] == [repr(e) for e in expected.errors]
+            )
+        self.assertTrue(result.invalid_rows()[:5] == [1, 2, 3, 4, 6])
+
+        self.assertRaises(
+            Exception,
+            self.wolf_forms.validate_columns,
+            {"name": ["a"], "email": []},
+            "columns_form",
+        )
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    def test_validate_numpy_columns(self):
+        validators = [
+            {"count": {"type": "int", "expression": "field_value >= 18"}},
+            {"price": {"type": "float", "expression": "100 > field_value"}},
+            {"agree": {"type": "bool", "expression": "field_value == True"}},
+            {"ratio": {"type": "int", "expression": "field_value * 2 != 3.0"}},
+            {"score": {"expression": "field_value != 0.5"}},
+            {"name": {"required": True, "max_length": 4}},
+        ]
+        self.wolf_forms.add_form("numpy_columns_form", validators)
+        columns = {
+            "count": numpy.array([30, 12, 18, 40, 5] * 20, dtype=numpy.int64),
+            "price": numpy.array([9.5, 150.0, 99.9, 100.0, 1.0] * 20),
+            "agree": numpy.array([True, False, True, True, False] * 20),
+            "ratio": numpy.array([1.5, 2.0, 0.5, 3.0, 1.0] * 20),
+            "score": numpy.array([0.5, 1, 2, 0, 3] * 20, dtype=numpy.int32),
+            "name": ["ross", "", "wolf", "forms", "ok"] * 20,
+        }
+        result = self.wolf_forms.validate_columns(columns, "numpy_columns_form")
+        self.assertTrue(len(result) == 100)
+        for row_index in range(len(result)):
+            row = {
+                name: column.tolist()[row_index]
+                if isinstance(column, numpy.ndarray)
+                else column[row_index]
+                for name, column in columns.items()
+            }
+            expected = self.wolf_forms.validate(row, "numpy_columns_form")
+            response = result[row_index]
+            self.assertTrue(bool(result.valid[row_index]) == expected.valid)
+            self.assertTrue(response.valid == expected.valid)
+            self.assertTrue(
+                [repr(e) for e in response.errors] == [repr(e) for e in expected.errors]
+            )
+        self.assertTrue(result.invalid_rows()[:5] == [0, 1, 2, 3, 4])
+
+    def test_fail_fast(self):
+        calls = []
+
+        @custom_validate_function(WolfForms, cost=3)
+        def is_logged(form, response, field_name, validate_function, value):
+            calls.append(field_name)
+            return response
+
+        validators = [
+            {
+                "first": {
+                    "regex_search": "^[a-z]+$",
+                    "is_logged": True,
+                    "max_length": 3,
+                    "required": True,
+                }
+            },
+            {"second": {"is_logged": True, "min_length": 2}},
+        ]
+        self.wolf_forms.add_form("fail_fast_form", validators)
+        plan = self.wolf_forms.get_plan("fail_fast_form", fail_fast=True)
+        self.assertTrue(
+            [rule[1] for rule in plan[0][1]]
+            == ["max_length", "required", "is_logged", "regex_search"]
+        )
+        # without fail_fast custom rules keep their declared place
+        plan = self.wolf_forms.get_plan("fail_fast_form")
+        self.assertTrue(
+            [rule[1] for rule in plan[0][1]]
+            == ["regex_search", "is_logged", "max_length", "required"]
+        )
+
+        form = {"first": "a" * 10000 + "!", "second": "a"}
+        response = self.wolf_forms.validate(dict(form), "fail_fast_form")
+        self.assertTrue(len(response.errors) == 3 and calls == ["first", "second"])
+
+        calls.clear()
+        response = self.wolf_forms.validate(
+            dict(form), "fail_fast_form", fail_fast="field"
+        )
+        self.assertTrue(
+            [e.validate_function for e in response.errors]
+            == ["max_length", "min_length"]
+        )
+        self.assertTrue(calls == [])
+
+        # later fields still run past their first rule after an earlier failure
+        self.wolf_forms.add_form(
+            "fail_fast_field_form",
+            [{"a": {"required": True}}, {"b": {"min_length": 1, "max_length": 3}}],
+        )
+        response = self.wolf_forms.validate(
+            {"a": "", "b": "toolong"}, "fail_fast_field_form", fail_fast="field"
+        )
+        self.assertTrue(
+            [e.validate_function for e in response.errors] == ["required", "max_length"]
+        )
+
+        response = self.wolf_forms.validate(
+            dict(form), "fail_fast_form", csrf=True, fail_fast=True
+        )
+        self.assertTrue(
+            [e.validate_function for e in response.errors] == ["max_length"]
+        )
+
+        response = self.wolf_forms.validate(
+            {"first": "abc", "second": "ab"}, "fail_fast_form", fail_fast=True
+        )
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+        self.assertTrue(calls == ["first", "second"])
+
+        # a failed length rule keeps an oversized value away from the regex
+        # and expression rules in every mode
+        self.wolf_forms.add_form(
+            "length_guard_form",
+            [
+                {
+                    "x": {
+                        "max_length": 5,
+                        "regex_search": "^(a+)+$",
+                        "expression": "field_value.isalpha()",
+                    }
+                }
+            ],
+        )
+        form = {"x": "a" * 28 + "!"}
+        for fail_fast in (False, "field", True):
+            response = self.wolf_forms.validate(
+                dict(form), "length_guard_form", fail_fast=fail_fast
+            )
+            self.assertTrue(
+                [e.validate_function for e in response.errors] == ["max_length"]
+            )
+            response = asyncio.run(
+                self.wolf_forms.avalidate(
+                    dict(form), "length_guard_form", fail_fast=fail_fast
+                )
+            )
+            self.assertTrue(
+                [e.validate_function for e in response.errors] == ["max_length"]
+            )
+            response, _ = self.wolf_forms.validate_and_parse(
+                form, "length_guard_form", fail_fast=fail_fast
+            )
+            self.assertTrue(
+                [e.validate_function for e in response.errors] == ["max_length"]
+            )
+        response = self.wolf_forms.validate_field("length_guard_form", "x", form["x"])
+        self.assertTrue(
+            [e.validate_function for e in response.errors] == ["max_length"]
+        )
+        result = self.wolf_forms.validate_columns(
+            {"x": [form["x"], "aaa", "ab1"]}, "length_guard_form"
+        )
+        self.assertTrue(
+            [
+                [e.validate_function for e in errors]
+                for errors in map(result.errors, range(3))
+            ]
+            == [["max_length"], [], ["expression", "regex_search"]]
+        )
+
     def test_parse_form(self):
         form = {
             "test_string": 1,
@@ -107,6 +735,491 @@ class TestWolfForms(unittest.TestCase):
         form["test_bool"] = "true"
         self.wolf_forms.parse_form(form, "test_form")
 
+    def test_validate_and_parse(self):
+        validators = [
+            {"name": {"required": True, "max_length": 10}},
+            {"age": {"type": "int", "required": True, "min_length": 1}},
+            {"tags": {"type": "list"}},
+            {"extra": {"type": "dict"}},
+            {"agree": {"type": "bool"}},
+            {"email": {"type": "email"}},
+        ]
+        self.wolf_forms.add_form("parse_form", validators)
+        form = MultiDict(
+            [
+                ("name", "ross"),
+                ("name", "ignored"),
+                ("age", "30"),
+                ("tags", "a,b"),
+                ("agree", "true"),
+                ("email", "ross@wolf.com"),
+            ]
+        )
+        response, parsed = self.wolf_forms.validate_and_parse(form, "parse_form")
+        self.assertTrue(len(form) == 5 and "extra" not in form)
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+        self.assertTrue(parsed["name"] == "ross" and parsed["age"] == 30)
+        self.assertTrue(parsed["tags"] == ["a", "b"] and parsed["extra"] == "")
+        self.assertTrue(parsed["agree"] is True)
+        self.assertTrue(parsed["email"] == "ross@wolf.com")
+
+        form = {"name": "", "age": "thirty", "extra": '{"a": 1}', "agree": "maybe"}
+        response, parsed = self.wolf_forms.validate_and_parse(form, "parse_form")
+        self.assertTrue(len(form) == 4)
+        self.assertTrue(
+            [e.error for e in response.errors]
+            == [
+                "name is required",
+                "age is not int",
+                "agree is not bool",
+                "email is not a valid email address",
+            ]
+        )
+        self.assertTrue(parsed["extra"] == {"a": 1} and parsed["agree"] == "maybe")
+
+        response, parsed = self.wolf_forms.validate_and_parse(
+            form, "parse_form", fail_fast=True
+        )
+        self.assertTrue(len(response.errors) == 1 and list(parsed) == ["name"])
+
+        response, parsed = self.wolf_forms.validate_and_parse(form, "missing_form")
+        self.assertTrue(response.valid is False and parsed == {})
+
+    def test_bounded_list_parsing(self):
+        wolf_forms = WolfForms(max_field_size=50)
+        validators = [
+            {"ids": {"type": "list", "item_type": "int", "max_items": 5}},
+            {"scores": {"type": "list", "item_type": "float"}},
+            {"names": {"type": "list", "max_length": 10}},
+            {"extra": {"type": "dict"}},
+        ]
+        wolf_forms.add_form("list_form", validators)
+        form = {"ids": "1,2,3", "scores": "0.5,1", "names": "a,b", "extra": "{}"}
+        parsed = wolf_forms.parse_form(form, "list_form")
+        self.assertTrue(parsed["ids"] == array("q", [1, 2, 3]))
+        self.assertTrue(parsed["scores"] == array("d", [0.5, 1.0]))
+        self.assertTrue(parsed["names"] == ["a", "b"])
+        parsed = wolf_forms.parse_form(form, "list_form", lazy=True)
+        self.assertTrue(list(parsed["ids"]) == [1, 2, 3])
+        self.assertTrue(list(parsed["names"]) == ["a", "b"])
+
+        for field_name, value in (
+            ("ids", "1,2,3,4,5,6"),
+            ("names", "a,b,c,d,e,f"),
+            ("extra", '{"a": "%s"}' % ("a" * 50)),
+        ):
+            self.assertRaises(
+                Exception,
+                wolf_forms.parse_form,
+                dict(form, **{field_name: value}),
+                "list_form",
+            )
+
+        response, parsed = wolf_forms.validate_and_parse(form, "list_form")
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+        self.assertTrue(parsed["ids"] == array("q", [1, 2, 3]))
+        validators = [{"ids": {"item_type": "int", "max_items": 5}}]
+        form.update(ids="1,2,x,4,5,6", scores="")
+        response = wolf_forms.validate(dict(form), None, validators)
+        self.assertTrue(
+            [e.validate_function for e in response.errors] == ["max_items", "item_type"]
+        )
+        response = wolf_forms.validate({"ids": [1, 2]}, None, validators)
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+
+        # bool items must be true or false, other item types are rejected
+        validators = [{"flags": {"item_type": "bool"}}]
+        response = wolf_forms.validate({"flags": "true,False"}, None, validators)
+        self.assertTrue(response.valid is True)
+        response = wolf_forms.validate({"flags": "true,yes"}, None, validators)
+        self.assertTrue(response.errors[0].validate_function == "item_type")
+        response = wolf_forms.validate({"flags": [True, 1]}, None, validators)
+        self.assertTrue(response.valid is False)
+        with self.assertRaisesRegex(Exception, "Invalid item_type"):
+            wolf_forms.add_form("email_items", [{"ids": {"item_type": "email"}}])
+
+        # and are parsed to bools
+        wolf_forms.add_form(
+            "bool_list_form", [{"flags": {"type": "list", "item_type": "bool"}}]
+        )
+        parsed = wolf_forms.parse_form({"flags": "true,False"}, "bool_list_form")
+        self.assertTrue(parsed["flags"] == [True, False])
+        parsed = wolf_forms.parse_form({"flags": "true,False"}, "bool_list_form", True)
+        self.assertTrue(list(parsed["flags"]) == [True, False])
+        response, parsed = wolf_forms.validate_and_parse(
+            {"flags": "false,TRUE"}, "bool_list_form"
+        )
+        self.assertTrue(response.valid is True and parsed["flags"] == [False, True])
+        self.assertRaises(
+            Exception, wolf_forms.parse_form, {"flags": "true,yes"}, "bool_list_form"
+        )
+        response, parsed = wolf_forms.validate_and_parse(form, "list_form")
+        self.assertTrue(len(response.errors) == 2 and parsed["ids"] == form["ids"])
+        response, parsed = wolf_forms.validate_and_parse(
+            dict(form, ids="1", extra="[" * 60), "list_form"
+        )
+        self.assertTrue(response.errors[0].error.startswith("Could not parse extra"))
+
+    def test_response_and_error(self):
+        error = Error(
+            field_name="test",
+            validate_function="min_length",
+            value=3,
+            message="{field_name} must be at least [{value}] characters",
+        )
+        self.assertTrue(error._error is None)
+        self.assertTrue(error.error == "test must be at least [3] characters")
+        self.assertTrue(
+            repr(error) == "test must be at least [3] characters in test. min_length "
+            "failed to validate using 3"
+        )
+        error.error = "custom"
+        self.assertTrue(error.error == "custom")
+        self.assertTrue(Error("plain").error == "plain")
+        self.assertRaises(AttributeError, setattr, error, "other", 1)
+
+        response = Response()
+        self.assertTrue(repr(response) == "Valid: True\nErrors: 0")
+        self.assertRaises(AttributeError, setattr, response, "other", 1)
+
+        form = {"test": "a"}
+        validators = [{"test": {"min_length": 3, "type": "int"}}]
+        response = self.wolf_forms.validate(form, None, validators)
+        response = pickle.loads(pickle.dumps(response))
+        self.assertTrue(
+            [e.error for e in response.errors]
+            == ["test must be at least [3] characters", "test is not int"]
+        )
+
+    def test_validate_field(self):
+        calls = []
+
+        @custom_validate_function(WolfForms)
+        def is_counted(form, response, field_name, validate_function, value):
+            calls.append(form[field_name])
+            return response
+
+        validators = [
+            {"username": {"required": True, "min_length": 3}},
+            {"email": {"type": "email", "is_counted": True}},
+            {"username": {"regex_search": "^[a-z]+$"}},
+        ]
+        self.wolf_forms.add_form("field_form", validators)
+        response = self.wolf_forms.validate_field("field_form", "username", "Ro")
+        self.assertTrue(
+            [e.validate_function for e in response.errors]
+            == ["min_length", "regex_search"]
+        )
+        cached = self.wolf_forms.validate_field("field_form", "username", "Ro")
+        self.assertTrue(cached is not response)
+        self.assertTrue(
+            [e.validate_function for e in cached.errors]
+            == ["min_length", "regex_search"]
+        )
+        cached.errors.append(Error(error="username taken"))
+        cached = self.wolf_forms.validate_field("field_form", "username", "Ro")
+        self.assertTrue(len(cached.errors) == 2)
+        response = self.wolf_forms.validate_field("field_form", "username", "ross")
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+
+        # custom rules are not memoized
+        self.wolf_forms.validate_field("field_form", "email", "ross@wolf.com")
+        self.wolf_forms.validate_field("field_form", "email", "ross@wolf.com")
+        self.assertTrue(calls == ["ross@wolf.com", "ross@wolf.com"])
+
+        response = self.wolf_forms.validate_field("field_form", "fish", "a")
+        self.assertTrue(
+            response.errors[0].error == "Field: fish not found in form field_form"
+        )
+
+        # values are memoized with their types
+        self.wolf_forms.add_form("bool_form", [{"x": {"type": "bool"}}])
+        response = self.wolf_forms.validate_field("bool_form", "x", 1)
+        self.assertTrue(response.valid is False)
+        response = self.wolf_forms.validate_field("bool_form", "x", True)
+        self.assertTrue(response.valid is True)
+
+        # redefining the form drops memoized results
+        self.wolf_forms.add_form("field_form", [{"username": {"max_length": 1}}])
+        response = self.wolf_forms.validate_field("field_form", "username", "Ro")
+        self.assertTrue(response.errors[0].validate_function == "max_length")
+
+    def test_instrumentation(self):
+        events = []
+        instrumentation = Instrumentation(sink=lambda *event: events.append(event))
+        wolf_forms = WolfForms(
+            signed_csrf=True, secret_key="fish", instrumentation=instrumentation
+        )
+        wolf_forms.add_form(
+            "timed_form",
+            [{"username": {"required": True, "regex_search": "^[a-z]+$"}}],
+        )
+        wolf_forms.validate({"username": "ross"}, "timed_form")
+        response = wolf_forms.validate({"username": "Ross"}, "timed_form")
+        self.assertTrue(response.errors[0].validate_function == "regex_search")
+        token = wolf_forms.generate_csrf()
+        self.assertTrue(wolf_forms.validate_token(token))
+        self.assertFalse(wolf_forms.validate_token("fish"))
+
+        stats = instrumentation.stats()
+        regex_stats = stats[("timed_form", "username", "regex_search")]
+        self.assertTrue(regex_stats["calls"] == 2 and regex_stats["failures"] == 1)
+        self.assertTrue(sum(count for _, count in regex_stats["histogram"]) == 2)
+        self.assertTrue(stats[("timed_form", "username", "required")]["failures"] == 0)
+        token_stats = stats[(None, "csrf_token", "validate_token")]
+        self.assertTrue(token_stats["calls"] == 2 and token_stats["failures"] == 1)
+        self.assertTrue(stats[(None, "csrf_token", "generate_csrf")]["calls"] == 1)
+        self.assertTrue(len(events) == 7)
+        self.assertTrue(events[-1][:3] == (None, "csrf_token", "validate_token"))
+
+        # ad-hoc rules joined to a form's plan reuse their wrappers
+        plan = wolf_forms.get_plan("timed_form")
+        wrapped = instrumentation.wrap_plan("timed_form", plan)
+        adhoc = [{"email": {"required": True}}]
+        for _ in range(2):
+            joined = instrumentation.wrap_plan(
+                "timed_form", wolf_forms.resolve_plan("timed_form", adhoc)
+            )
+            self.assertTrue(joined[1][1] is wrapped[0][1])
+        self.assertTrue(
+            joined[0][1]
+            is instrumentation.wrap_plan(
+                "timed_form", wolf_forms.get_adhoc_plan(adhoc)
+            )[0][1]
+        )
+
+        instrumentation.reset()
+        self.assertTrue(instrumentation.stats() == {})
+        wolf_forms.instrumentation = None
+        wolf_forms.validate({"username": "ross"}, "timed_form")
+        self.assertTrue(instrumentation.stats() == {} and len(events) == 7)
+
+    def test_validate_cache(self):
+        wolf_forms = WolfForms(
+            signed_csrf=True, validate_cache_size=2, validate_cache_ttl=0.2
+        )
+        wolf_forms.add_form(
+            "cached_form",
+            [{"age": {"type": "int"}}, {"name": {"required": True}}],
+        )
+        response = wolf_forms.validate({"age": 1, "name": "ross"}, "cached_form")
+        form = {"age": 1, "name": "ross", "csrf_token": "fish"}
+        cached = wolf_forms.validate(form, "cached_form")
+        self.assertTrue(cached is not response and cached.valid is True)
+        self.assertTrue(wolf_forms.validate_cache_stats()["hits"] == 1)
+
+        # callers can add their own errors without changing the cache
+        for result in (response, cached):
+            result.valid = False
+            result.errors.append(Error(error="username taken"))
+        response = wolf_forms.validate(form, "cached_form")
+        self.assertTrue(response.valid is True and len(response.errors) == 0)
+        self.assertTrue(wolf_forms.validate_cache_stats()["hits"] == 2)
+
+        # a failed csrf check doesn't change the cached response
+        csrf_response = wolf_forms.validate(form, "cached_form", csrf=True)
+        self.assertTrue(csrf_response.valid is False and response.valid is True)
+        self.assertTrue(len(response.errors) == 0)
+
+        # values are keyed with their types
+        response = wolf_forms.validate({"age": True, "name": "ross"}, "cached_form")
+        self.assertTrue(response.valid is True)
+        response = wolf_forms.validate({"age": 1.0, "name": "ross"}, "cached_form")
+        self.assertTrue(response.errors[0].validate_function == "_type")
+
+        # missing fields are still filled in on a hit
+        wolf_forms.validate({"age": 1}, "cached_form")
+        form = {"age": 1}
+        wolf_forms.validate(form, "cached_form")
+        self.assertTrue(form == {"age": 1, "name": ""})
+        self.assertTrue(wolf_forms.validate_cache_stats()["size"] == 2)
+
+        sleep(0.25)
+        hits = wolf_forms.validate_cache_stats()["hits"]
+        wolf_forms.validate({"age": 1}, "cached_form")
+        self.assertTrue(wolf_forms.validate_cache_stats()["hits"] == hits)
+
+        # redefining the form drops its cached results
+        wolf_forms.validate({"age": 1}, "cached_form")
+        wolf_forms.add_form("cached_form", [{"age": {"type": "str"}}])
+        response = wolf_forms.validate({"age": 1}, "cached_form")
+        self.assertTrue(response.valid is False)
+
+        # forms with custom rules are never cached
+        calls = []
+
+        @custom_validate_function(WolfForms)
+        def is_cached_call(form, response, field_name, validate_function, value):
+            calls.append(field_name)
+            return response
+
+        wolf_forms.add_form("custom_form", [{"name": {"is_cached_call": True}}])
+        wolf_forms.validate({"name": "ross"}, "custom_form")
+        wolf_forms.validate({"name": "ross"}, "custom_form")
+        self.assertTrue(calls == ["name", "name"])
+
+    def test_load_forms(self):
+        wolf_forms = WolfForms()
+        wolf_forms.add_form("kept_form", [{"name": {"required": True}}])
+        with tempfile.TemporaryDirectory() as directory:
+            forms_dir = os.path.join(directory, "forms")
+            cache_dir = os.path.join(directory, "cache")
+            os.mkdir(forms_dir)
+            with open(os.path.join(forms_dir, "users.json"), "w") as f:
+                f.write(
+                    '{"login": [{"username": {"required": true, "min_length": 3}}],'
+                    ' "age": [{"age": {"expression": "field_value.isdigit()"}}]}'
+                )
+            with open(os.path.join(forms_dir, "posts.json"), "w") as f:
+                f.write('{"post": [{"title": {"max_length": 5}}]}')
+
+            names = wolf_forms.load_forms(forms_dir, cache_dir)
+            self.assertTrue(names == ["age", "login", "post"])
+            self.assertTrue(len(os.listdir(cache_dir)) == 1)
+            response = wolf_forms.validate({"username": "Ro"}, "login")
+            self.assertTrue(response.errors[0].validate_function == "min_length")
+            response = wolf_forms.validate({"age": "30"}, "age")
+            self.assertTrue(response.valid is True)
+
+            # a later start with the same files loads the cached artifact
+            cached_wolf_forms = WolfForms()
+            self.assertTrue(cached_wolf_forms.load_forms(forms_dir, cache_dir) == names)
+            self.assertTrue(len(os.listdir(cache_dir)) == 1)
+            self.assertTrue(
+                cached_wolf_forms.forms["login"] == wolf_forms.forms["login"]
+            )
+
+            # only checked data comes from the cache, expressions in it are
+            # compiled and checked again
+            cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+            with open(cache_file, "rb") as f:
+                artifact = marshal.load(f)
+            self.assertTrue(set(artifact) == {"forms"})
+            artifact["forms"]["age"] = [
+                {"age": {"expression": "().__class__.__base__.__subclasses__()"}}
+            ]
+            with open(cache_file, "wb") as f:
+                marshal.dump(artifact, f)
+            with self.assertRaisesRegex(Exception, "private attribute"):
+                WolfForms().load_forms(forms_dir, cache_dir)
+            artifact["forms"]["age"] = "not validators"
+            with open(cache_file, "wb") as f:
+                marshal.dump(artifact, f)
+            poisoned_wolf_forms = WolfForms()
+            self.assertTrue(
+                poisoned_wolf_forms.load_forms(forms_dir, cache_dir) == names
+            )
+            response = poisoned_wolf_forms.validate({"age": "x"}, "age")
+            self.assertTrue(response.valid is False)
+
+            # hot reload swaps the forms, plans already in use are untouched
+            self.assertFalse(wolf_forms.reload_forms())
+            plan = wolf_forms.get_plan("login")
+            with open(os.path.join(forms_dir, "users.json"), "w") as f:
+                f.write(
+                    '{"login": [{"username": {"required": true, "min_length": 5}}]}'
+                )
+            self.assertTrue(wolf_forms.reload_forms())
+            response = wolf_forms.validate({"username": "Ross"}, "login")
+            self.assertTrue(response.valid is False)
+            response = Response()
+            self.assertTrue(
+                wolf_forms.run_plan({"username": "Ross"}, plan, response).valid is True
+            )
+            self.assertTrue("age" not in wolf_forms.forms)
+            self.assertTrue("kept_form" in wolf_forms.forms)
+
+            # add_form wins over a form of the same name in the files
+            wolf_forms.add_form("login", [{"username": {"max_length": 100}}])
+            with open(os.path.join(forms_dir, "users.json"), "w") as f:
+                f.write(
+                    '{"login": [{"username": {"required": true, "max_length": 1}}]}'
+                )
+            self.assertTrue(wolf_forms.reload_forms())
+            self.assertTrue(
+                wolf_forms.forms["login"] == [{"username": {"max_length": 100}}]
+            )
+            response = wolf_forms.validate({"username": "Ross"}, "login")
+            self.assertTrue(response.valid is True)
+
+            # a broken file keeps the current forms
+            with open(os.path.join(forms_dir, "posts.json"), "w") as f:
+                f.write('{"post": ')
+            with self.assertRaises(Exception):
+                wolf_forms.reload_forms()
+            self.assertTrue("post" in wolf_forms.forms)
+
+            # the cache is best effort, an unusable cache_dir still loads
+            blocked_dir = os.path.join(forms_dir, "posts.json", "cache")
+            uncached_wolf_forms = WolfForms()
+            with open(os.path.join(forms_dir, "posts.json"), "w") as f:
+                f.write('{"post": [{"title": {"max_length": 5}}]}')
+            self.assertTrue(
+                "post" in uncached_wolf_forms.load_forms(forms_dir, blocked_dir)
+            )
+            with open(os.path.join(forms_dir, "posts.json"), "w") as f:
+                f.write('{"post": [{"title": {"expression": 5}}]}')
+            with self.assertRaisesRegex(Exception, "Invalid expression"):
+                uncached_wolf_forms.load_forms(forms_dir)
+            with open(os.path.join(forms_dir, "posts.json"), "w") as f:
+                f.write('{"post": ')
+
+            wolf_forms.watch_forms(interval=0.05)
+            sleep(0.2)
+            self.assertTrue("Could not load forms" in str(wolf_forms.reload_error))
+            with open(os.path.join(forms_dir, "posts.json"), "w") as f:
+                f.write('{"article": [{"title": {"max_length": 5}}]}')
+            sleep(0.2)
+            wolf_forms.stop_watching_forms()
+            self.assertTrue(wolf_forms.reload_error is None)
+            self.assertTrue("article" in wolf_forms.forms)
+            self.assertTrue("post" not in wolf_forms.forms)
+
+    def test_lazy_imports(self):
+        import sys
+        import subprocess
+
+        code = (
+            "import sys\n"
+            "from wolf_forms import WolfForms\n"
+            "wolf_forms = WolfForms()\n"
+            "wolf_forms.add_form('form', [{'age': {'type': 'int'}}])\n"
+            "wolf_forms.validate({'age': 30}, 'form')\n"
+            "wolf_forms.parse_form({'age': '30'}, 'form')\n"
+            "print(' '.join(sorted(sys.modules)))\n"
+        )
+        modules = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.split()
+        for module in ("flask_bcrypt", "bcrypt", "asyncio", "sqlite3", "hmac"):
+            self.assertTrue(module not in modules, module)
+
+    def test_benchmarks(self):
+        from . import benchmarks
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            argv = ["--filter", "parse", "--repeat", "1", "--output", output]
+            self.assertTrue(benchmarks.main(argv) == 0)
+            argv = ["--filter", "parse", "--repeat", "1", "--compare", output]
+            self.assertTrue(benchmarks.main(argv + ["--threshold", "100"]) == 0)
+
+        baseline = {"results": {"a": {"value": 1.0, "unit": "s"}}}
+        current = {
+            "results": {
+                "a": {"value": 1.5, "unit": "s"},
+                "b": {"value": 2.0, "unit": "s"},
+            }
+        }
+        rows, regressions = benchmarks.compare(baseline, current, 0.1)
+        self.assertTrue(regressions == ["a"] and rows[1][3] == "new")
+        rows, regressions = benchmarks.compare(baseline, current, 0.6)
+        self.assertTrue(regressions == [])
+
     def test_invalid_method(self):
         # test invalid validate function
         form = {"test": "test"}
@@ -180,6 +1293,53 @@ class TestWolfForms(unittest.TestCase):
         response = self.wolf_forms.validate(form, "test_form")
         self.assertTrue(response.errors[0].validate_function == "regex_search")
 
+    def test_compiled_regex(self):
+        pattern = re.compile("^[a-z]+$")
+        self.assertTrue(compile_regex("hello") == re.compile("hello").search)
+        self.assertTrue(compile_regex(pattern) == pattern.match)
+        self.assertTrue(
+            compile_regex(r"\A[a-z]+\Z") == re.compile(r"\A[a-z]+\Z").fullmatch
+        )
+        self.assertTrue(compile_regex("^a|b") == re.compile("^a|b").search)
+        multiline = re.compile("^b", re.MULTILINE)
+        self.assertTrue(compile_regex(multiline) == multiline.search)
+        for regex in ("^[a-z]+$", "^a|b", r"\A\d+\Z", "^(a|b)c"):
+            for text in ("abc", "xb", "123", "bc", "ac\n", ""):
+                self.assertTrue(
+                    bool(compile_regex(regex)(text)) == bool(re.search(regex, text))
+                )
+
+        form = {"test": "hello"}
+        validators = [{"test": {"regex_search": pattern}}]
+        self.wolf_forms.add_form("test_form", validators)
+        response = self.wolf_forms.validate(form, "test_form")
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+        form = {"test": "Hello"}
+        response = self.wolf_forms.validate(form, "test_form")
+        self.assertTrue(response.errors[0].value is pattern)
+        response = self.wolf_forms.validate(
+            form, None, [{"test": {"regex_search": "^H"}}]
+        )
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+
+    def test_compiled_expression(self):
+        code = compile_expression("field_value > 1")
+        self.assertTrue(compile_expression("field_value > 1") is code)
+        self.assertTrue(eval(code, {"__builtins__": {}}, {"field_value": 2}))
+        with self.assertRaisesRegex(Exception, "Invalid expression"):
+            compile_expression(5)
+        with self.assertRaisesRegex(Exception, "Invalid expression"):
+            self.wolf_forms.add_form("bad_expression", [{"x": {"expression": 5}}])
+        for source in (
+            "field_value.__class__",
+            "'{0.__class__.__mro__}'.format(field_value)",
+            "'{x.__class__}'.format_map({'x': field_value})",
+            "field_value.format(field_value)",
+        ):
+            with self.assertRaisesRegex(Exception, "Invalid expression"):
+                compile_expression(source)
+        self.assertTrue(compile_expression("'ab'.startswith(field_value)"))
+
     def test_min_length_method(self):
         # test min_length validate function
         form = {"test": "a"}
@@ -219,6 +1379,29 @@ class TestWolfForms(unittest.TestCase):
         response = self.wolf_forms.validate(form, "test_form")
         self.assertTrue(response.errors[0].validate_function == "expression")
 
+        validators = [
+            {"test": {"expression": "field_value.isdigit() and field_value[0] != '0'"}}
+        ]
+        self.wolf_forms.add_form("test_form", validators)
+        response = self.wolf_forms.validate({"test": "10"}, "test_form")
+        self.assertTrue(len(response.errors) == 0 and response.valid is True)
+        response = self.wolf_forms.validate({"test": "01"}, "test_form")
+        self.assertTrue(response.errors[0].validate_function == "expression")
+
+        # expressions are checked when the form is added
+        for expression in (
+            "__import__('os')",
+            "len(field_value) > 1",
+            "field_value.__class__",
+            "[x for x in field_value]",
+            "lambda: 1",
+            "field_value ==",
+        ):
+            validators = [{"test": {"expression": expression}}]
+            self.assertRaises(
+                Exception, self.wolf_forms.add_form, "test_form", validators
+            )
+
     def test_custom_method(self):
         # test custom validate function
         @custom_validate_function(WolfForms)
@@ -247,3 +1430,14 @@ class TestWolfForms(unittest.TestCase):
         form = {"test": "I am cool"}
         response = self.wolf_forms.validate(form, "test_form")
         self.assertTrue(response.errors[0].validate_function == "is_groovy")
+
+        # built in rules declared after a custom rule still run after it
+        validators = [{"test": {"is_groovy": True, "min_length": 50}}]
+        self.wolf_forms.add_form("groovy_length_form", validators)
+        response = self.wolf_forms.validate(
+            {"test": "I am groovy"}, "groovy_length_form"
+        )
+        self.assertTrue(response.valid is False)
+        self.assertTrue(
+            [e.validate_function for e in response.errors] == ["min_length"]
+        )